@@ -1,24 +1,37 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware 
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 import os
 import json
 import time
 import logging
-import boto3
-from botocore.exceptions import ClientError
 import uuid
+import math
 import asyncio
+from functools import lru_cache
 
-from function import chat_with_bedrock, image_to_text, download_file_from_s3, convert_pydantic_to_bedrock_tool, function_calling_with_bedrock, semantic_search, get_opensearch_client, invoke_bedrock_model_stream,get_bedrock_client
+from function import get_opensearch_client, invoke_bedrock_model_stream, get_bedrock_client, get_s3_client
+from pipeline import (caption_image, decompose_query, complement_queries, search_terms, iter_search_terms,
+                      search_by_image, resolve_reference, generate_answer, run_assist)
 from prompt_template import prompt_multi_query
+from complements import known_complements
+from similar_items import store as similar_items_store, MAX_SIMILAR_ITEMS
+from opentelemetry import context as otel_context
+from opentelemetry.propagate import extract
+from opentelemetry.trace import SpanKind
+from tracing import setup_tracing, tracer
+from resilience import ServiceOverloaded, set_request_deadline
+from metrics import REQUEST_LATENCY, REQUESTS_IN_FLIGHT, render_metrics
+from responses import FastJSONResponse, CompressResponses, dumps
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Product Search API", version="1.0.0")
+app = FastAPI(title="Product Search API", version="1.0.0", default_response_class=FastJSONResponse)
+setup_tracing()
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +40,50 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressResponses)
+
+@lru_cache(maxsize=None)
+def route_paths() -> frozenset:
+    # Built on the first request, once every route below is registered
+    return frozenset(route.path for route in app.routes)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Label by route template so unknown paths don't blow up label cardinality
+    endpoint = request.url.path if request.url.path in route_paths() else "other"
+
+    start_time = time.perf_counter()
+    status = "500"
+    REQUESTS_IN_FLIGHT.labels(endpoint=endpoint).inc()
+    try:
+        # Continue the caller's trace if it sent a W3C traceparent header
+        with tracer.start_as_current_span(
+            f"{request.method} {endpoint}", context=extract(request.headers), kind=SpanKind.SERVER
+        ) as span:
+            response = await call_next(request)
+            status = str(response.status_code)
+            span.set_attribute("http.status_code", response.status_code)
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.labels(endpoint=endpoint).dec()
+        REQUEST_LATENCY.labels(method=request.method, endpoint=endpoint, status=status).observe(
+            time.perf_counter() - start_time
+        )
+
+@app.middleware("http")
+async def apply_request_deadline(request: Request, call_next):
+    # Bedrock retries and queueing in resilience.call_bedrock give up once this runs out
+    set_request_deadline()
+    return await call_next(request)
+
+@app.exception_handler(ServiceOverloaded)
+async def service_overloaded_handler(request: Request, exc: ServiceOverloaded):
+    logger.warning(f"Shedding {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
 
 # Pydantic models
 class FindingDocumentsRequest(BaseModel):
@@ -36,13 +93,15 @@ class FindingDocumentsRequest(BaseModel):
 class ImageCaptioningRequest(BaseModel):
     image_path: str
 
-class GenerationRequest(BaseModel):
-    question: str
-    reference: str = ""
+class ImageSearchRequest(BaseModel):
+    image_path: str
+    top_k: int = 3
 
 class StyleComplementRequest(BaseModel):
     user_query: str
     image_prompt: str
+    # Catalogue id (imageUrl) of the item the shopper has; known items skip the LLM
+    product_id: Optional[str] = None
 
 
 class DocumentResult(BaseModel):
@@ -57,12 +116,18 @@ class DocumentResult(BaseModel):
 #     results: List[str]
     # results: str
 
+class ProductVariant(BaseModel):
+    name: str
+    price: str
+    imageUrl: str
+
 class SearchResult(BaseModel):
     score: float  # adjust fields according to what semantic_search returns
     id: str
     name: str
     description: str
     price: str
+    variants: List[ProductVariant] = []
 
 class DocumentResult(BaseModel):
     search_term: str
@@ -71,8 +136,38 @@ class DocumentResult(BaseModel):
 class FindingDocumentsResponse(BaseModel):
     results: List[DocumentResult]
 
+class GenerationRequest(BaseModel):
+    question: str
+    reference: str = ""
+    # Preferred over reference: the server trims these to a token budget
+    search_results: List[DocumentResult] = []
+    product_ids: List[str] = []
+
+class ReferenceStats(BaseModel):
+    reference_tokens: int
+    original_tokens: int
+    tokens_saved: int
+    products_included: int
+    duplicates_removed: int
+
+class SimilarItemsRequest(BaseModel):
+    product_id: str
+    k: int = Field(5, ge=1, le=MAX_SIMILAR_ITEMS)
+
+class SimilarItem(BaseModel):
+    id: str
+    name: str
+    price: str
+    score: float
+
+class SimilarItemsResponse(BaseModel):
+    product_id: str
+    results: List[SimilarItem]
+
 class StyleComplementResponse(BaseModel):
     results: str
+    # Catalogue products, when served from the precomputed complement graph
+    products: List[SearchResult] = []
 
 class ImageCaptioningResponse(BaseModel):
     results: str
@@ -80,6 +175,21 @@ class ImageCaptioningResponse(BaseModel):
 
 class GenerationResponse(BaseModel):
     response: str
+    context: Optional[ReferenceStats] = None
+
+class AssistRequest(BaseModel):
+    user_query: str
+    image_path: str = ""
+    feature: Literal["product_matching", "style_matching"] = "product_matching"
+
+class AssistResponse(BaseModel):
+    caption: str
+    complement: Optional[str] = None
+    results: List[DocumentResult]
+    response: str
+    context: Optional[ReferenceStats] = None
+    image_url: Optional[str] = None
+    processing_time: float
 
 class PresignedUrlRequest(BaseModel):
     fileName: str
@@ -93,19 +203,19 @@ class PresignedUrlResponse(BaseModel):
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 # Add this new endpoint
 @app.post("/get-presigned-url", response_model=PresignedUrlResponse)
 async def get_presigned_url(request: PresignedUrlRequest):
-    aws_access_key = os.environ.get("AWS_ACCESS_KEY_ID")
-    aws_secret_key = os.environ.get("AWS_SECRET_ACCESS_KEY")
-    region = os.environ.get("AWS_DEFAULT_REGION", "us-east-1")
+    from botocore.exceptions import ClientError
+
     try:
-        s3_client = boto3.client(
-            "s3",
-            region_name=region,
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_key,
-        )
+        s3_client = get_s3_client()
 
         # Generate unique key for the file
         file_extension = request.fileName.split('.')[-1] if '.' in request.fileName else ''
@@ -136,132 +246,100 @@ async def get_presigned_url(request: PresignedUrlRequest):
         logger.error(f"Unexpected error in get_presigned_url: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-client = get_opensearch_client()
-bedrock_client = get_bedrock_client()
 @app.post("/finding_documents", response_model=FindingDocumentsResponse)
 async def finding_documents(request: FindingDocumentsRequest):
     try:
-        # Assuming you have a function to convert Pydantic to Bedrock tool format
-        # product_search_tool = convert_pydantic_to_bedrock_tool(ProductSearch)
-
-
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "text": (
-                            f"Chat history: {request.user_query}\n"
-                            f"Image context: {request.image_prompt}\n\n"
-                            f"Instructions:\n"
-                            f"- Identify all distinct product mentions from the latest user message.\n"
-                            f"- Generate exactly one simple query per item, staying close to user phrasing.\n"
-                            f"- Return output as a JSON array of strings."
-                        )
-                    }
-                ]
-            }
-        ]
-        response = await function_calling_with_bedrock(messages)
-        search_term = response["choices"][0]["message"]["content"]
-        
-        if isinstance(search_term, str):
-            search_term = json.loads(search_term)  # list of strings
-
-        # print(search_term)
-        # print(search_term["response"])
-        # for term in search_term["response"]:
-        #     print(term)
-
-        async def search(term):
-            result = await asyncio.to_thread(semantic_search, term, client, top_k=3)
-            return {
-                "search_term": term,
-                "search_results": result
-            }
-
-        final_search = await asyncio.gather(*(search(term) for term in search_term["response"]))
-        # final_search = []
-        # for term in search_term["response"]:
-        #     each_term = {"search_term": term, "search_results": semantic_search(term, client, top_k=3)}
-        #     final_search.append(each_term)
-
-        return FindingDocumentsResponse(results=final_search)
-        # return FindingDocumentsResponse(results=search_term)
+        terms = await decompose_query(request.user_query, request.image_prompt)
+        final_search = await search_terms(terms, get_opensearch_client())
+        # Already FindingDocumentsResponse-shaped: serialize without re-validating
+        return FastJSONResponse({"results": final_search})
         
+    except ServiceOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error in finding_documents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/search_by_image", response_model=FindingDocumentsResponse)
+async def search_by_image_endpoint(request: ImageSearchRequest):
+    # Skips captioning and query decomposition: the photo itself is the query
+    try:
+        result = await search_by_image(request.image_path, get_opensearch_client(), top_k=request.top_k)
+        return FastJSONResponse({"results": [result]})
+
+    except ServiceOverloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error in search_by_image: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/finding_documents_stream")
+async def finding_documents_stream(request: FindingDocumentsRequest):
+    """
+    NDJSON variant of /finding_documents: one {"type": "result", ...DocumentResult} line per
+    search term in completion order, then a {"type": "summary", ...} line.
+    """
+    try:
+        start_time = time.time()
+        # Decompose before streaming starts so failures still map to a proper status code
+        terms = await decompose_query(request.user_query, request.image_prompt)
+    except ServiceOverloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error in finding_documents_stream: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def frames():
+        failed = []
+        first_result_time = None
+        async for doc in iter_search_terms(terms, get_opensearch_client()):
+            if "error" in doc:
+                failed.append(doc["search_term"])
+                yield dumps({"type": "error", **doc}) + b"\n"
+                continue
+            if first_result_time is None:
+                first_result_time = time.time() - start_time
+            yield dumps({"type": "result", **doc}) + b"\n"
+        yield dumps({
+            "type": "summary",
+            "search_terms": terms,
+            "failed_terms": failed,
+            "time_to_first_result": first_result_time,
+            "processing_time": time.time() - start_time,
+        }) + b"\n"
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
+
 @app.post("/style_complement", response_model=StyleComplementResponse)
 async def style_complement(request: StyleComplementRequest):
     try:
-        
-        # Generate multiple queries using Bedrock
-        # messages = [
-        #     {
-        #         "role": "system", 
-        #         "content": (
-        #             "You are a fashion recommendation assistant. Based on the image, assume the user already owns the outfit shown. "
-        #             "Your goal is to suggest what the user might want next to complete, complement, or contrast with the look. "
-        #             "This includes suggestions for shoes, bags, accessories, layering options, casual variations, or ways to remix items. "
-        #             "Avoid repeating or rephrasing what they are already wearing (e.g. gray suit or red tie). "
-        #             "Return only a short list (5–7 max) of helpful search queries in this format: a JSON array of strings."
-        #         )
-        #     },
-        #     {
-        #         "role": "user", 
-        #         "content": (
-        #             f"User query: {request.user_query}. "
-        #             f"Image context: {request.image_prompt}. "
-        #             f"Return a list of search queries the user might want next — not descriptions."
-        #         )
-        #     }
-        # ]
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "You are a fashion recommendation assistant. The user will provide a fashion item they already have and ask for something that complements it. "
-                    "Your job is to return 5–7 **search queries** in JSON array format, based ONLY on what the user is requesting (e.g., if they ask for 'shorts to go with my shirt', suggest shorts). "
-                    "\n\nRules:\n"
-                    "1. Identify the item the user ALREADY OWNS from their message.\n"
-                    "2. Identify the item the user WANTS — this is what you will recommend.\n"
-                    "3. Do NOT return search queries for the item they already own.\n"
-                    "4. If any color, fabric, or style is mentioned, use that to enrich the query.\n"
-                    "5. If the item they already own has a cultural, bohemian, or ethnic vibe, ensure your suggestions stylistically align.\n"
-                    "6. Return ONLY a JSON array of strings. No markdown, no prose, no formatting."
-                )
-            },
-            {
-                "role": "user",
-                "content": request.user_query
-            }
-        ]
-        
-        response = await chat_with_bedrock(messages)
-        search_term = response["choices"][0]["message"]["content"]
-        
-        logger.info(f"Generated queries: {search_term}")
-        
+        known = known_complements(request.product_id, request.user_query)
+        if known is not None:
+            # Same shape as the LLM's output (a JSON array of queries) for existing clients
+            return StyleComplementResponse(results=json.dumps([product["name"] for product in known]), products=known)
+        search_term = await complement_queries(request.user_query)
         return StyleComplementResponse(results=search_term)
         
+    except ServiceOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error in finding_documents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/similar_items", response_model=SimilarItemsResponse)
+async def similar_items(request: SimilarItemsRequest):
+    # Precomputed by INGESTION/similar.py: no embedding call and no kNN query
+    table = similar_items_store.get()
+    results = table.similar(request.product_id, request.k) if table is not None else None
+    if results is None:
+        raise HTTPException(status_code=404, detail=f"No similar items for product '{request.product_id}'")
+    return FastJSONResponse({"product_id": request.product_id, "results": results})
+
 @app.post("/image_captioning", response_model=ImageCaptioningResponse)
 async def image_captioning(request: ImageCaptioningRequest):
     try:
         start_time = time.time()
-        model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-        # Mock image processing
-        download_file_from_s3(request.image_path, "images/latest.png")
-        response_caption = await image_to_text(model_id,
-                        "Please describe the content of this image in detail",
-                        input_image="images/latest.png")
-        # caption = mock_process_image(request.image_path)
-        
+        response_caption = await caption_image(request.image_path)
         processing_time = time.time() - start_time
         
         return ImageCaptioningResponse(
@@ -269,6 +347,8 @@ async def image_captioning(request: ImageCaptioningRequest):
             processing_time=processing_time
         )
         
+    except ServiceOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error in image_captioning: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -276,38 +356,34 @@ async def image_captioning(request: ImageCaptioningRequest):
 @app.post("/generation", response_model=GenerationResponse)
 async def generation(request: GenerationRequest):
     try:
-        if not request.reference:
-            response_text = "Hello, I am a Customer Service Assistant. Please provide a query with relevant product context."
-        else:
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a helpful customer service assistant. Answer the user's question based only on the provided product information. "
-                        "Recommend general dress styles that might suit the user's need, without mentioning specific product names. "
-                        "Keep your tone warm and human-like, and avoid bullet points or numbered lists. "
-                        "Suggest the user explore the search results for specific items. "
-                        "If there isn’t enough information to answer, say 'I don't know.'"
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Based on this product information: {request.reference}\n\n"
-                        f"And this question: {request.question}\n\n"
-                        f"Please give a short, natural-sounding response following the instructions."
-                    )
-                }
-            ]
-            
-            response = await chat_with_bedrock(messages)
-            response_text = response["choices"][0]["message"]["content"]
-        
-        return GenerationResponse(response=response_text)
+        reference, context = await resolve_reference(
+            request.reference, [doc.model_dump() for doc in request.search_results], request.product_ids, get_opensearch_client()
+        )
+        response_text = await generate_answer(request.question, reference)
+        return FastJSONResponse({"response": response_text, "context": context})
         
+    except ServiceOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error in generation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/assist", response_model=AssistResponse)
+async def assist(request: AssistRequest):
+    """
+    Run captioning, style complement, search and generation in one call,
+    passing intermediate results in memory instead of over HTTP.
+    """
+    try:
+        start_time = time.time()
+        result = await run_assist(request.image_path, request.user_query, request.feature, get_opensearch_client())
+        return FastJSONResponse({**result, "processing_time": time.time() - start_time})
+        
+    except ServiceOverloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error in assist: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
     
 
 # @app.post("/generation_stream", response_model=GenerationResponse)
@@ -332,24 +408,28 @@ async def generation(request: GenerationRequest):
 #         logger.error(f"Error in generation: {e}")
 #         raise HTTPException(status_code=500, detail=str(e))
 
-from fastapi.responses import StreamingResponse
 
 @app.post("/generation_stream")
 async def generation_stream(request: GenerationRequest):
     try:
-        return StreamingResponse(
-            invoke_bedrock_model_stream(
-                client=bedrock_client,
-                # id="anthropic.claude-3-haiku-20240307-v1:0",
-                id="anthropic.claude-3-5-haiku-20241022-v1:0'",
-                prompt=request.question,  # or build full prompt from request.reference
-                reference=request.reference,
-                max_tokens=2000,
-                temperature=0,
-                top_p=0.9
-            ),
-            media_type="text/plain"
+        reference, context = await resolve_reference(
+            request.reference, [doc.model_dump() for doc in request.search_results], request.product_ids, get_opensearch_client()
+        )
+        # Awaited here, not inside the response: a shed call must surface as a 503 before streaming starts
+        stream = await invoke_bedrock_model_stream(
+            client=get_bedrock_client(),
+            # id="anthropic.claude-3-haiku-20240307-v1:0",
+            id="anthropic.claude-3-5-haiku-20241022-v1:0",
+            prompt=request.question,  # or build full prompt from request.reference
+            reference=reference,
+            max_tokens=2000,
+            temperature=0,
+            top_p=0.9,
+            trace_context=otel_context.get_current()
         )
+        return StreamingResponse(stream, media_type="text/plain")
+    except ServiceOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error in generation_stream: {e}")
         raise HTTPException(status_code=500, detail=str(e))
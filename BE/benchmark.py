@@ -0,0 +1,190 @@
+import re
+import sys
+import json
+import gzip
+import time
+import argparse
+import subprocess
+from collections import defaultdict
+
+# "import time:       412 |       1873 |   opensearchpy.connection"
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def profile_imports(module: str = "app") -> list:
+    """
+    Import module in a fresh interpreter under -X importtime.
+
+    Returns:
+        list: one dict per imported module with name, self_us, cumulative_us and depth
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    records = []
+    other = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append({
+                "name": name,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+                "depth": (len(indent) - 1) // 2,
+            })
+        elif not line.startswith("import time:"):
+            other.append(line)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n" + "\n".join(other))
+    return records
+
+
+def summarize_imports(records: list, top: int = 15) -> dict:
+    """Total import time, plus the heaviest top-level packages (self time) and modules (cumulative)"""
+    by_package = defaultdict(int)
+    for record in records:
+        by_package[record["name"].split(".")[0]] += record["self_us"]
+    packages = sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+    modules = sorted(records, key=lambda record: record["cumulative_us"], reverse=True)[:top]
+    return {
+        "total_ms": sum(record["self_us"] for record in records) / 1000,
+        "module_count": len(records),
+        "packages": [{"name": name, "self_ms": us / 1000} for name, us in packages],
+        "modules": [{"name": record["name"], "cumulative_ms": record["cumulative_us"] / 1000} for record in modules],
+    }
+
+
+def print_import_report(module: str, summary: dict) -> None:
+    print(f"import {module}: {summary['total_ms']:.1f} ms across {summary['module_count']} modules")
+    print("\nHeaviest packages (self time):")
+    for package in summary["packages"]:
+        print(f"  {package['self_ms']:8.1f} ms  {package['name']}")
+    print("\nHeaviest modules (cumulative):")
+    for record in summary["modules"]:
+        print(f"  {record['cumulative_ms']:8.1f} ms  {record['name']}")
+
+
+def run_importtime(args) -> int:
+    summary = summarize_imports(profile_imports(args.module), top=args.top)
+    print_import_report(args.module, summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"module": args.module, **summary}, f, indent=2)
+    if args.budget_ms and summary["total_ms"] > args.budget_ms:
+        print(f"\nImport time {summary['total_ms']:.1f} ms exceeds budget of {args.budget_ms:.1f} ms")
+        return 1
+    return 0
+
+
+def sample_products(count: int, description_chars: int = 1500) -> list:
+    """SearchResult-shaped products with catalogue-length descriptions"""
+    description = ("Relaxed linen shirt with a camp collar, patch pocket and mother-of-pearl buttons. " * 40)[:description_chars]
+    return [{
+        "score": 0.8 - i / 1000,
+        "id": f"assets/product-{i}.jpg",
+        "name": f"Linen Camp Collar Shirt {i}",
+        "description": description,
+        "price": "$49.00",
+        "variants": [{"name": f"Linen Camp Collar Shirt {i} (Sage)", "price": "$49.00", "imageUrl": f"assets/product-{i}-sage.jpg"}],
+    } for i in range(count)]
+
+
+def sample_payloads(terms: int, top_k: int) -> dict:
+    """One representative response body per JSON endpoint, keyed by endpoint"""
+    results = [{"search_term": f"search term {t}", "search_results": sample_products(top_k)} for t in range(terms)]
+    context = {"reference_tokens": 900, "original_tokens": 4200, "tokens_saved": 3300,
+               "products_included": terms * top_k, "duplicates_removed": 2}
+    return {
+        "/finding_documents": {"results": results},
+        "/assist": {"caption": "A sage linen shirt on a hanger", "complement": None, "results": results,
+                    "response": "A relaxed linen shirt pairs well with light chinos. " * 6, "context": context,
+                    "image_url": None, "processing_time": 2.5},
+        "/similar_items": {"product_id": "assets/product-0.jpg",
+                           "results": [{"id": f"assets/product-{i}.jpg", "name": f"Shirt {i}", "price": "$49.00", "score": 0.9}
+                                       for i in range(20)]},
+    }
+
+
+def time_per_call(fn, iterations: int) -> float:
+    """Best-of-three mean wall time of fn() in milliseconds"""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        best = min(best, (time.perf_counter() - start) / iterations)
+    return best * 1000
+
+
+def measure_serialization(iterations: int = 200, terms: int = 5, top_k: int = 3) -> list:
+    """
+    Per-endpoint encoding cost of FastAPI's default path (build the response model,
+    re-validate it against response_model, json.dumps) against FastJSONResponse on
+    the plain payload, plus body size before and after gzip.
+    """
+    from app import FindingDocumentsResponse, AssistResponse, SimilarItemsResponse
+    from responses import dumps
+
+    models = {"/finding_documents": FindingDocumentsResponse, "/assist": AssistResponse, "/similar_items": SimilarItemsResponse}
+
+    def default_path(model, payload):
+        built = model(**payload)
+        validated = model.model_validate(built.model_dump())
+        return json.dumps(validated.model_dump(mode="json"), ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+    report = []
+    for endpoint, payload in sample_payloads(terms, top_k).items():
+        model = models[endpoint]
+        body = dumps(payload)
+        default_ms = time_per_call(lambda: default_path(model, payload), iterations)
+        fast_ms = time_per_call(lambda: dumps(payload), iterations)
+        report.append({
+            "endpoint": endpoint,
+            "default_ms": default_ms,
+            "fast_ms": fast_ms,
+            "speedup": default_ms / fast_ms if fast_ms else None,
+            "bytes": len(body),
+            "gzip_bytes": len(gzip.compress(body)),
+        })
+    return report
+
+
+def run_serialization(args) -> int:
+    report = measure_serialization(args.iterations, args.terms, args.top_k)
+    print(f"{'endpoint':<20} {'default ms':>10} {'fast ms':>8} {'speedup':>8} {'bytes':>8} {'gzip':>8}")
+    for row in report:
+        print(f"{row['endpoint']:<20} {row['default_ms']:>10.3f} {row['fast_ms']:>8.3f} "
+              f"{row['speedup']:>7.1f}x {row['bytes']:>8} {row['gzip_bytes']:>8}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"terms": args.terms, "top_k": args.top_k, "endpoints": report}, f, indent=2)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importtime = commands.add_parser("importtime", help="Per-module import-time breakdown (cold start)")
+    importtime.add_argument("--module", default="app", help="Module to import (default: app)")
+    importtime.add_argument("--top", type=int, default=15)
+    importtime.add_argument("--budget-ms", type=float, default=0, help="Exit non-zero if total import time exceeds this")
+    importtime.add_argument("--json", help="Also write the report to this JSON file")
+    importtime.set_defaults(run=run_importtime)
+
+    serialization = commands.add_parser("serialization", help="Per-endpoint response encoding time and size")
+    serialization.add_argument("--iterations", type=int, default=200)
+    serialization.add_argument("--terms", type=int, default=5, help="Search terms per response")
+    serialization.add_argument("--top-k", type=int, default=3, help="Products per search term")
+    serialization.add_argument("--json", help="Also write the report to this JSON file")
+    serialization.set_defaults(run=run_serialization)
+
+    args = parser.parse_args()
+    sys.exit(args.run(args))
+
+
+if __name__ == "__main__":
+    main()
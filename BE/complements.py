@@ -0,0 +1,84 @@
+import os
+import re
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from metrics import COMPLEMENT_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Built offline by INGESTION/complements.py from the catalogue's "Matches Well With" sections
+COMPLEMENT_GRAPH = os.environ.get("COMPLEMENT_GRAPH", "complement_graph.json")
+MAX_COMPLEMENTS = int(os.environ.get("MAX_COMPLEMENTS", "7"))
+
+
+def _normalize_name(name: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", name.lower()))
+
+
+class ComplementGraph:
+    """Complementary-item adjacency table held in memory; a lookup is a couple of dict reads"""
+
+    def __init__(self, products: List[Dict], edges: Dict[str, List]):
+        self.products = products
+        self.row_by_id = {product["id"]: row for row, product in enumerate(products)}
+        self.row_by_name = {_normalize_name(product["name"]): row for row, product in enumerate(products)}
+        self.edges = {int(row): targets for row, targets in edges.items()}
+
+    @classmethod
+    def load(cls, path: str = COMPLEMENT_GRAPH):
+        if not os.path.exists(path):
+            logger.info(f"No complement graph at {path}; style_complement always uses the LLM")
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        logger.info(f"Loaded complement graph with {len(data['products'])} products from {path}")
+        return cls(data["products"], data["edges"])
+
+    def find(self, product_id: Optional[str] = None, name: Optional[str] = None) -> Optional[int]:
+        if product_id and product_id in self.row_by_id:
+            return self.row_by_id[product_id]
+        if name:
+            return self.row_by_name.get(_normalize_name(name))
+        return None
+
+    def complements(self, row: int, limit: int = MAX_COMPLEMENTS) -> List[Dict]:
+        """
+        Best-scoring complements, round-robin across categories so a shopper sees
+        a top, shoes and a bag rather than three tops.
+
+        Returns:
+            list: SearchResult-shaped product dicts with the suggestion's category
+        """
+        by_category = defaultdict(list)
+        for category, target, score in sorted(self.edges.get(row, []), key=lambda edge: -edge[2]):
+            by_category[category].append((target, score))
+
+        results, seen = [], set()
+        queues = list(by_category.items())
+        while queues and len(results) < limit:
+            for category, targets in list(queues):
+                while targets and targets[0][0] in seen:
+                    targets.pop(0)
+                if not targets:
+                    queues.remove((category, targets))
+                    continue
+                target, score = targets.pop(0)
+                seen.add(target)
+                results.append({**self.products[target], "score": score, "category": category})
+                if len(results) == limit:
+                    break
+        return results
+
+
+graph = ComplementGraph.load()
+
+
+def known_complements(product_id: Optional[str], user_query: str) -> Optional[List[Dict]]:
+    """Complements for a catalogue product (by id, or a query that is exactly its name), else None"""
+    row = graph.find(product_id, user_query) if graph is not None else None
+    results = graph.complements(row) if row is not None else []
+    COMPLEMENT_LOOKUPS.labels(outcome="hit" if results else "miss").inc()
+    return results or None
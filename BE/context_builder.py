@@ -0,0 +1,103 @@
+import os
+import re
+from typing import List, Dict, Any, Tuple
+
+from metrics import REFERENCE_TOKENS
+
+# Generation prompts only need enough product context to recommend styles
+REFERENCE_TOKEN_BUDGET = int(os.environ.get("REFERENCE_TOKEN_BUDGET", "1200"))
+DESCRIPTION_TOKEN_LIMIT = int(os.environ.get("REFERENCE_DESCRIPTION_TOKENS", "120"))
+CHARS_PER_TOKEN = 4
+
+# Catalogue copy ends with a long styling paragraph that only matters for /style_complement
+MATCHES_SECTION = re.compile(r"\s*Matches Well With:.*$", re.DOTALL)
+
+
+def count_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token), good enough for budgeting"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, preferring a sentence or word boundary"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind(". "), cut.rfind("; "))
+    if boundary > max_chars // 2:
+        return cut[:boundary + 1]
+    return cut.rsplit(" ", 1)[0] + "…"
+
+
+def _ranked_products(search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Interleave results across search terms by rank (every term's best hit first),
+    so a tight budget still covers every item the shopper asked about.
+    """
+    ranked = []
+    depth = max((len(doc["search_results"]) for doc in search_results), default=0)
+    for rank in range(depth):
+        for doc in search_results:
+            if rank < len(doc["search_results"]):
+                ranked.append(doc["search_results"][rank])
+    return ranked
+
+
+def format_product(product: Dict[str, Any]) -> str:
+    description = MATCHES_SECTION.sub("", product.get("description", ""))
+    description = truncate_to_tokens(description, DESCRIPTION_TOKEN_LIMIT)
+    return f"- {product.get('name', '')} ({product.get('price', '')}): {description}"
+
+
+def build_reference(search_results: List[Dict[str, Any]] = None, products: List[Dict[str, Any]] = None,
+                    token_budget: int = REFERENCE_TOKEN_BUDGET) -> Tuple[str, Dict[str, int]]:
+    """
+    Build the product context pasted into generation prompts.
+
+    Dedupes products by id, keeps only name, price and a trimmed description,
+    and stops adding products once token_budget is reached.
+
+    Args:
+        search_results: finding_documents-style [{"search_term", "search_results"}] (ranked per term)
+        products: flat list of products, e.g. looked up by id
+        token_budget: max estimated tokens for the whole reference
+
+    Returns:
+        tuple: (reference text, stats with reference_tokens, original_tokens, tokens_saved,
+                products_included, duplicates_removed)
+    """
+    candidates = list(products or []) + _ranked_products(search_results or [])
+    # What the DEMO clients used to send: str() of everything
+    original_tokens = count_tokens(str(search_results or []) + str(products or []))
+
+    seen = set()
+    lines = []
+    used_tokens = 0
+    duplicates = 0
+    for product in candidates:
+        product_id = product.get("id") or product.get("name")
+        if product_id in seen:
+            duplicates += 1
+            continue
+        seen.add(product_id)
+
+        line = format_product(product)
+        line_tokens = count_tokens(line) + 1
+        if used_tokens + line_tokens > token_budget:
+            break
+        lines.append(line)
+        used_tokens += line_tokens
+
+    reference = "\n".join(lines)
+    reference_tokens = count_tokens(reference)
+    stats = {
+        "reference_tokens": reference_tokens,
+        "original_tokens": original_tokens,
+        "tokens_saved": max(0, original_tokens - reference_tokens),
+        "products_included": len(lines),
+        "duplicates_removed": duplicates,
+    }
+    REFERENCE_TOKENS.labels(kind="sent").inc(reference_tokens)
+    REFERENCE_TOKENS.labels(kind="saved").inc(stats["tokens_saved"])
+    return reference, stats
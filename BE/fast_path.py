@@ -0,0 +1,173 @@
+import os
+import re
+import json
+import zlib
+import logging
+import argparse
+import threading
+
+import numpy as np
+
+from metrics import FAST_PATH_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+# off: always call the LLM; shadow: call it anyway and record agreement; on: skip it when confident
+FAST_PATH_MODE = os.environ.get("FAST_PATH_MODE", "shadow")
+FAST_PATH_THRESHOLD = float(os.environ.get("FAST_PATH_THRESHOLD", "0.9"))
+FAST_PATH_MODEL = os.environ.get("FAST_PATH_MODEL", "fast_path_model.npz")
+# Where LLM decompositions are appended for training ("" disables logging)
+DECOMPOSITION_LOG = os.environ.get("DECOMPOSITION_LOG", "")
+
+HASH_DIM = 2 ** 12
+MAX_WORDS = 8
+NO_IMAGE_PROMPTS = {"", "no image provided", "none"}
+# Anything that usually means more than one item, or a conversation rather than a product name
+MULTI_ITEM = re.compile(r",|&|\+|/|\b(and|or|with|also|plus|both)\b|[?{}\[\]:]", re.IGNORECASE)
+WORD = re.compile(r"[a-z0-9]+")
+
+_log_lock = threading.Lock()
+
+
+def normalize(text: str) -> str:
+    return " ".join(WORD.findall(text.lower()))
+
+
+def passes_rules(query: str, image_prompt: str) -> bool:
+    """Cheap guards: a short plain product phrase with no image context to fold in"""
+    if normalize(image_prompt) not in NO_IMAGE_PROMPTS:
+        return False
+    words = normalize(query).split()
+    return 0 < len(words) <= MAX_WORDS and not MULTI_ITEM.search(query)
+
+
+def featurize(queries) -> np.ndarray:
+    """
+    Hashed bag of words + character trigrams, L2-normalised, plus a length feature.
+
+    Args:
+        queries: list of query strings
+
+    Returns:
+        np.ndarray: (len(queries), HASH_DIM + 1) float32 matrix
+    """
+    features = np.zeros((len(queries), HASH_DIM + 1), dtype=np.float32)
+    for row, query in enumerate(queries):
+        text = normalize(query)
+        grams = text.split() + [text[i:i + 3] for i in range(max(len(text) - 2, 0))]
+        for gram in grams:
+            features[row, zlib.crc32(gram.encode()) % HASH_DIM] += 1.0
+        features[row, -1] = len(text.split()) / MAX_WORDS
+    norms = np.linalg.norm(features[:, :-1], axis=1, keepdims=True)
+    features[:, :-1] /= np.maximum(norms, 1e-6)
+    return features
+
+
+def is_single_product_label(query: str, terms) -> bool:
+    """Training label: the LLM returned one term that is essentially the query itself"""
+    if len(terms) != 1:
+        return False
+    query_words, term_words = set(normalize(query).split()), set(normalize(terms[0]).split())
+    if not query_words or not term_words:
+        return False
+    return len(query_words & term_words) / len(query_words | term_words) >= 0.6
+
+
+class FastPathClassifier:
+    """Logistic regression over hashed n-grams; small enough to score in microseconds"""
+
+    def __init__(self, weights: np.ndarray, bias: float):
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def load(cls, path: str = FAST_PATH_MODEL):
+        if not os.path.exists(path):
+            logger.info(f"No fast-path model at {path}; fast path disabled")
+            return None
+        data = np.load(path)
+        return cls(data["weights"], float(data["bias"]))
+
+    def save(self, path: str) -> None:
+        np.savez(path, weights=self.weights, bias=np.float32(self.bias))
+
+    def predict_proba(self, queries) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-(featurize(queries) @ self.weights + self.bias)))
+
+    @classmethod
+    def train(cls, queries, labels, epochs: int = 300, learning_rate: float = 0.5, l2: float = 1e-4):
+        """Full-batch gradient descent; the training set is a few thousand logged queries at most"""
+        x = featurize(queries)
+        y = np.asarray(labels, dtype=np.float32)
+        weights = np.zeros(x.shape[1], dtype=np.float32)
+        bias = 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(x @ weights + bias)))
+            error = p - y
+            weights -= learning_rate * (x.T @ error / len(y) + l2 * weights)
+            bias -= learning_rate * float(error.mean())
+        return cls(weights, bias)
+
+
+classifier = FastPathClassifier.load() if FAST_PATH_MODE != "off" else None
+
+
+def fast_path_terms(query: str, image_prompt: str):
+    """
+    Decide whether the query names a single product and can be searched as is.
+
+    Returns:
+        list: [query] when the fast path is confident, otherwise None
+    """
+    if classifier is None or not passes_rules(query, image_prompt):
+        return None
+    if classifier.predict_proba([query])[0] < FAST_PATH_THRESHOLD:
+        return None
+    return [query.strip()]
+
+
+def record_decomposition(query: str, image_prompt: str, terms, fast_terms) -> None:
+    """Log an LLM decomposition for training, and in shadow mode score the fast path against it"""
+    # Without a model fast_terms is always None; scoring that would only count the rules
+    if FAST_PATH_MODE == "shadow" and classifier is not None:
+        llm_single = is_single_product_label(query, terms)
+        if fast_terms is not None:
+            outcome = "agree" if llm_single else "false_positive"
+        else:
+            outcome = "false_negative" if llm_single else "agree"
+        FAST_PATH_DECISIONS.labels(outcome=outcome).inc()
+
+    if DECOMPOSITION_LOG:
+        with _log_lock, open(DECOMPOSITION_LOG, "a") as f:
+            f.write(json.dumps({"query": query, "image_prompt": image_prompt, "terms": terms}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the query-decomposition fast-path classifier")
+    parser.add_argument("log", help="JSONL of logged decompositions (see DECOMPOSITION_LOG)")
+    parser.add_argument("--out", default=FAST_PATH_MODEL)
+    args = parser.parse_args()
+
+    queries, labels = [], []
+    with open(args.log) as f:
+        for line in f:
+            record = json.loads(line)
+            # Only queries the rules would let through matter at serving time
+            if passes_rules(record["query"], record["image_prompt"]):
+                queries.append(record["query"])
+                labels.append(is_single_product_label(record["query"], record["terms"]))
+
+    if not queries or len(set(labels)) < 2:
+        raise SystemExit("Need logged examples of both single- and multi-product queries to train")
+
+    model = FastPathClassifier.train(queries, labels)
+    predictions = model.predict_proba(queries) >= FAST_PATH_THRESHOLD
+    accuracy = float((predictions == np.asarray(labels)).mean())
+    print(f"Trained on {len(queries)} queries ({sum(labels)} single-product), "
+          f"training accuracy at threshold {FAST_PATH_THRESHOLD}: {accuracy:.3f}")
+    model.save(args.out)
+    print(f"Saved model to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
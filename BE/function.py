@@ -1,44 +1,62 @@
-import boto3
 import json
 import os
+import base64
+import hashlib
 from typing import List, Dict, Any
-from botocore.exceptions import ClientError, NoCredentialsError
 import logging
 from dotenv import load_dotenv
 import json
 from pydantic import BaseModel, Field
 from typing import List, Optional
-from opensearchpy import OpenSearch
 import sys
+import asyncio
+import time
+import threading
+from functools import lru_cache, wraps
+
+from metrics import (stage_timer, record_upstream_error, STAGE_LATENCY, STAGE_S3_DOWNLOAD, STAGE_CAPTIONING,
+                     STAGE_QUERY_DECOMPOSITION, STAGE_EMBEDDING, STAGE_KNN_SEARCH, STAGE_GENERATION)
+from tracing import tracer, set_bedrock_usage
+from singleflight import SingleFlight
+from resilience import call_bedrock, ServiceOverloaded
+from quota import priority, PRIORITY_STREAMING
+from prompt_cache import with_cache_point, record_cache_usage
+from result_cache import search_cache
 
 class ProductSearch(BaseModel):
     response: List[str] = Field(description="List of simple product search queries")
 
-load_dotenv()
+# .env values win over the process environment (as the old hand-rolled loader did)
+load_dotenv(override=True)
 
 logger = logging.getLogger(__name__)
 
-def load_env_file():
-    """Load environment variables from .env file if it exists"""
-    if os.path.exists('.env'):
-        logger.info("Loading .env file...")
-        with open('.env', 'r') as f:
-            for line in f:
-                if '=' in line and not line.startswith('#'):
-                    key, value = line.strip().split('=', 1)
-                    os.environ[key] = value
-        return True
-    return False
-
-# Load .env file at module import
-load_env_file()
-
 AWS_S3_BUCKET_NAME = os.environ.get("AWS_S3_BUCKET_NAME")
 AWS_DEFAULT_REGION = os.environ["AWS_DEFAULT_REGION"]
 AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
+
+_client_lock = threading.Lock()
+
+def shared_client(build):
+    """
+    Build a client on first use and share it afterwards. The first uses race in worker
+    threads (asyncio.to_thread fan-out) and boto3.client() on the default session is not
+    thread-safe, so construction happens under a lock.
+    """
+    cached = lru_cache(maxsize=None)(build)
+
+    @wraps(build)
+    def get():
+        with _client_lock:
+            return cached()
+
+    get.cache_clear = cached.cache_clear
+    return get
+
+@shared_client
 def get_bedrock_client():
-    """Initialize Bedrock client with proper error handling"""
+    """Initialize Bedrock client with proper error handling (built on first use, then shared)"""
     try:
         # Check if credentials are available
         aws_access_key = os.environ.get("AWS_ACCESS_KEY_ID")
@@ -50,6 +68,8 @@ def get_bedrock_client():
             logger.info("Please set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
             return None
         
+        import boto3
+
         client = boto3.client(
             "bedrock-runtime",
             region_name=region,
@@ -64,8 +84,9 @@ def get_bedrock_client():
         logger.error(f"Failed to initialize Bedrock client: {e}")
         return None
 
+@shared_client
 def get_s3_client():
-    """Initialize Bedrock client with proper error handling"""
+    """Initialize S3 client with proper error handling (built on first use, then shared)"""
     try:
         # Check if credentials are available
         aws_access_key = os.environ.get("AWS_ACCESS_KEY_ID")
@@ -77,6 +98,8 @@ def get_s3_client():
             logger.info("Please set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
             return None
         
+        import boto3
+
         client = boto3.client(
             "s3",
             region_name=region,
@@ -91,10 +114,22 @@ def get_s3_client():
         logger.error(f"Failed to initialize Bedrock client: {e}")
         return None
 
+# Connections kept open per process. urllib3's default of 10 makes the 11th concurrent
+# search (one per decomposed term) wait for a free connection or open a new one.
+OPENSEARCH_POOL_SIZE = int(os.environ.get("OPENSEARCH_POOL_SIZE", "32"))
+OPENSEARCH_TIMEOUT = float(os.environ.get("OPENSEARCH_TIMEOUT", "10"))
+# What callers read from a hit; the 1024-float vectors stay on the cluster
+PRODUCT_SOURCE_FIELDS = ["imageUrl", "name", "description", "price", "variants"]
+
+@shared_client
 def get_opensearch_client():
     """
-    Function use to create a client for OpenSearch
+    Function use to create a client for OpenSearch (built on first use, then shared).
+    Connections are pooled and kept alive, and bodies are gzip-compressed.
     """
+    # opensearch-py pulls in urllib3/requests plumbing; keep it off the import path
+    from opensearchpy import OpenSearch
+
     AWS_OPENSEARCH_ENDPOINT = os.environ["AWS_OPENSEARCH_ENDPOINT"]
     AWS_OPENSEARCH_USERNAME = os.environ["AWS_OPENSEARCH_USERNAME"]
     AWS_OPENSEARCH_PASSWORD = os.environ["AWS_OPENSEARCH_PASSWORD"]
@@ -104,86 +139,129 @@ def get_opensearch_client():
     use_ssl=True,
     verify_certs=True,
     ssl_show_warn=False,
+    http_compress=True,
+    pool_maxsize=OPENSEARCH_POOL_SIZE,
+    timeout=OPENSEARCH_TIMEOUT,
     )
     return client
 
 
-async def invoke_bedrock_model_stream(client, id, prompt, reference, max_tokens=2000, temperature=0, top_p=0.9):
-    response = client.converse_stream(
-        modelId=id,
-            # {
-            #     "role": "system",
-            #     "content": (
-            #         "You are a helpful customer service assistant. Answer the user's question based only on the provided product information. "
-            #         "Recommend general dress styles that might suit the user's need, without mentioning specific product names. "
-            #         "Keep your tone warm and human-like, and avoid bullet points or numbered lists. "
-            #         "Suggest the user explore the search results for specific items. "
-            #         "If there isn’t enough information to answer, say 'I don't know.'"
-            #     )
-            # },
-
-        messages=[
-            # {
-            #     "role": "system",
-            #     "content": [
-            #         {
-            #             "text": (
-            #         "You are a helpful customer service assistant. Answer the user's question based only on the provided product information. "
-            #         "Recommend general dress styles that might suit the user's need, without mentioning specific product names. "
-            #         "Keep your tone warm and human-like, and avoid bullet points or numbered lists. "
-            #         "Suggest the user explore the search results for specific items. "
-            #         "If there isn’t enough information to answer, say 'I don't know.'"
-            #     )
-            #         }
-            #     ]
-            # },
-            {
-                "role": "user",
-                "content": [
+async def invoke_bedrock_model_stream(client, id, prompt, reference, max_tokens=2000, temperature=0, top_p=0.9, trace_context=None):
+    """
+    Start a converse_stream call and return an async generator over its text chunks.
+
+    The call itself (quota, concurrency slot, circuit breaker) happens here, before the
+    caller builds its StreamingResponse, so ServiceOverloaded can still become a 503.
+    """
+    # The generator only runs once StreamingResponse starts iterating, outside the request's
+    # context, so the span is started from the caller's trace context and ended by hand
+    span = tracer.start_span("bedrock.converse_stream", context=trace_context)
+    span.set_attribute("gen_ai.request.model", id)
+    start = time.perf_counter()
+    with priority(PRIORITY_STREAMING):
+        try:
+            response = await asyncio.to_thread(
+                call_bedrock, id, client.converse_stream,
+                modelId=id,
+                    # {
+                    #     "role": "system",
+                    #     "content": (
+                    #         "You are a helpful customer service assistant. Answer the user's question based only on the provided product information. "
+                    #         "Recommend general dress styles that might suit the user's need, without mentioning specific product names. "
+                    #         "Keep your tone warm and human-like, and avoid bullet points or numbered lists. "
+                    #         "Suggest the user explore the search results for specific items. "
+                    #         "If there isn’t enough information to answer, say 'I don't know.'"
+                    #     )
+                    # },
+
+                messages=[
+                    # {
+                    #     "role": "system",
+                    #     "content": [
+                    #         {
+                    #             "text": (
+                    #         "You are a helpful customer service assistant. Answer the user's question based only on the provided product information. "
+                    #         "Recommend general dress styles that might suit the user's need, without mentioning specific product names. "
+                    #         "Keep your tone warm and human-like, and avoid bullet points or numbered lists. "
+                    #         "Suggest the user explore the search results for specific items. "
+                    #         "If there isn’t enough information to answer, say 'I don't know.'"
+                    #     )
+                    #         }
+                    #     ]
+                    # },
                     {
-                        "text": (
-                    f"Based on this product information: {reference}\n\n"
-                    f"And this question: {prompt}\n\n"
-                    f"Please give a short, natural-sounding response following the instructions."
-                )
+                        "role": "user",
+                        "content": [
+                            {
+                                "text": (
+                            f"Based on this product information: {reference}\n\n"
+                            f"And this question: {prompt}\n\n"
+                            f"Please give a short, natural-sounding response following the instructions."
+                        )
+                            }
+                        ]
                     }
-                ]
-            }
-        ],
-        inferenceConfig={
-            "temperature": temperature,
-            "maxTokens": max_tokens,
-            "topP": top_p
-        }
-    )
-
-
-
-    # Yield the text in chunks
-    for event in response['stream']:
-        if 'contentBlockDelta' in event:
-            chunk = event['contentBlockDelta']['delta']['text']
-            yield chunk  # 👈 Yield each chunk
-
-
-# Initialize client
-bedrock_client = get_bedrock_client()
-s3_client = get_s3_client()
+                ],
+                inferenceConfig={
+                    "temperature": temperature,
+                    "maxTokens": max_tokens,
+                    "topP": top_p
+                }
+            )
+        except Exception as e:
+            span.record_exception(e)
+            span.end()
+            STAGE_LATENCY.labels(stage=STAGE_GENERATION).observe(time.perf_counter() - start)
+            raise
+
+    async def chunks():
+        # Yield the text in chunks
+        try:
+            for event in response['stream']:
+                if 'contentBlockDelta' in event:
+                    chunk = event['contentBlockDelta']['delta']['text']
+                    yield chunk  # 👈 Yield each chunk
+                elif 'metadata' in event:
+                    set_bedrock_usage(span, id, event['metadata'])
+        finally:
+            span.end()
+            STAGE_LATENCY.labels(stage=STAGE_GENERATION).observe(time.perf_counter() - start)
+
+    return chunks()
+
+
+# Clients are created lazily by the get_*_client() helpers so importing this module stays cheap
 model_id = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-5-haiku-20241022-v1:0')
-client = get_opensearch_client()
+TOOL_USE_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
 
 def download_file_from_s3(path_to_file_s3: str, download_path: str) -> None:
     # Configurations
     # object_key = path_to_file_s3  # key of the image in the bucket
     # download_path = 'Images/latest.png'  # where to save the image locally
     # Download the image
-    s3_client.download_file(AWS_S3_BUCKET_NAME, path_to_file_s3, download_path)
+    with tracer.start_as_current_span("s3.download_file") as span, stage_timer(STAGE_S3_DOWNLOAD):
+        span.set_attribute("s3.bucket", AWS_S3_BUCKET_NAME or "")
+        span.set_attribute("s3.key", path_to_file_s3)
+        try:
+            get_s3_client().download_file(AWS_S3_BUCKET_NAME, path_to_file_s3, download_path)
+        except Exception as e:
+            record_upstream_error("s3", e)
+            raise
     print(f"Image downloaded to {download_path}")
 
+def get_presigned_image_url(path_to_file_s3: str, expires_in: int = 300) -> str:
+    """Sign a short-lived GET URL for an uploaded image (local signing, no S3 round trip)"""
+    return get_s3_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': AWS_S3_BUCKET_NAME, 'Key': path_to_file_s3},
+        ExpiresIn=expires_in
+    )
+
 async def chat_with_bedrock(messages: List[Dict[str, str]]) -> Dict[str, Any]:
     """
     Use Bedrock's converse API for chat completion
     """
+    bedrock_client = get_bedrock_client()
     if bedrock_client is None:
         raise Exception("Bedrock client not initialized. Please check AWS credentials.")
     
@@ -211,14 +289,17 @@ async def chat_with_bedrock(messages: List[Dict[str, str]]) -> Dict[str, Any]:
         }
     }
     
-    # Add system prompts if any
+    # Add system prompts if any; they are static per endpoint, so cache them as the prompt prefix
     if system_prompts:
-        request_params["system"] = system_prompts
+        request_params["system"] = with_cache_point(system_prompts, model_id)
     
     logger.info(f"Calling Bedrock with model: {model_id}")
     
     # Call Bedrock converse API
-    response = bedrock_client.converse(**request_params)
+    with tracer.start_as_current_span("bedrock.converse") as span:
+        response = await asyncio.to_thread(call_bedrock, model_id, bedrock_client.converse, **request_params)
+        set_bedrock_usage(span, model_id, response)
+        record_cache_usage(span, model_id, response, "".join(p["text"] for p in system_prompts))
     
     # Extract response text
     response_text = response['output']['message']['content'][0]['text']
@@ -233,33 +314,43 @@ async def chat_with_bedrock(messages: List[Dict[str, str]]) -> Dict[str, Any]:
             }
         }]
     }
-async def function_calling_with_bedrock(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+async def function_calling_with_bedrock(messages: List[Dict[str, str]], system: Optional[str] = None) -> Dict[str, Any]:
     """
     Use Bedrock's converse API for chat completion
+
+    The tool spec and the optional system instructions never change between calls, so they
+    form the cacheable prompt prefix (tools -> system -> messages) ahead of the chat history.
     """
-    product_search_tool = convert_pydantic_to_bedrock_tool(ProductSearch)
+    from botocore.exceptions import ClientError, NoCredentialsError
+
+    bedrock_client = get_bedrock_client()
     if bedrock_client is None:
         raise Exception("Bedrock client not initialized. Please check AWS credentials.")
     
     try:
-        tools = [product_search_tool]
-
-        response = bedrock_client.converse(
-            modelId="anthropic.claude-3-haiku-20240307-v1:0",
-            # system=system_prompt,  # System instructions go here
-            messages=messages,
-            inferenceConfig={
-                'maxTokens': 4096,
-                'temperature': 0,
-                'topP': 1,
-            },
-            toolConfig={
-                "tools": tools,
-                "toolChoice": {
-                    "tool": {"name": "ProductSearch"}  # Fixed: should match your actual tool name
-                }
-            },
-        )
+        tools = with_cache_point([PRODUCT_SEARCH_TOOL], TOOL_USE_MODEL_ID)
+        system_prompts = with_cache_point([{"text": system}], TOOL_USE_MODEL_ID) if system else []
+
+        with tracer.start_as_current_span("bedrock.converse.tool_use") as span, stage_timer(STAGE_QUERY_DECOMPOSITION):
+            response = await asyncio.to_thread(
+                call_bedrock, TOOL_USE_MODEL_ID, bedrock_client.converse,
+                modelId=TOOL_USE_MODEL_ID,
+                **({"system": system_prompts} if system_prompts else {}),  # System instructions go here
+                messages=messages,
+                inferenceConfig={
+                    'maxTokens': 4096,
+                    'temperature': 0,
+                    'topP': 1,
+                },
+                toolConfig={
+                    "tools": tools,
+                    "toolChoice": {
+                        "tool": {"name": "ProductSearch"}  # Fixed: should match your actual tool name
+                    }
+                },
+            )
+            set_bedrock_usage(span, TOOL_USE_MODEL_ID, response)
+            record_cache_usage(span, TOOL_USE_MODEL_ID, response, json.dumps(PRODUCT_SEARCH_TOOL) + (system or ""))
 
         output = response['output']['message']['content'][0]['toolUse']['input']
         print(output)
@@ -273,6 +364,8 @@ async def function_calling_with_bedrock(messages: List[Dict[str, str]]) -> Dict[
             }]
         }
         
+    except ServiceOverloaded:
+        raise
     except ClientError as e:
         error_code = e.response['Error']['Code']
         error_message = e.response['Error']['Message']
@@ -337,10 +430,13 @@ async def image_to_text(model_id,
     messages = [message]
 
     # Send the message.
-    response = bedrock_client.converse(
-        modelId=model_id,
-        messages=messages
-    )
+    with tracer.start_as_current_span("bedrock.converse.image") as span, stage_timer(STAGE_CAPTIONING):
+        response = await asyncio.to_thread(
+            call_bedrock, model_id, get_bedrock_client().converse,
+            modelId=model_id,
+            messages=messages
+        )
+        set_bedrock_usage(span, model_id, response)
 
     return response['output']['message']['content'][0]['text']
 
@@ -420,6 +516,9 @@ def convert_pydantic_to_bedrock_tool(
     }
     return tool
 
+# Built once: the tool spec is part of the cached prompt prefix and must stay byte-identical
+PRODUCT_SEARCH_TOOL = convert_pydantic_to_bedrock_tool(ProductSearch)
+
 # def mock_process_image(image_path: str) -> str:
 #     """
 #     Mock image processing - returns fixed caption
@@ -485,34 +584,42 @@ def creating_index_body(index_name, dimension=1024):
         }
     }
     
+    client = get_opensearch_client()
     if not client.indices.exists(index=index_name):
         print(f"Index '{index_name}' does not exist. Creating a new one")
     else:
         response = client.indices.delete(index=index_name)
         print(f"Index '{index_name}' deleted successfully.")
     client.indices.create(index=index_name, body=create_index_body)
+embedding_flight = SingleFlight("embedding")
+search_flight = SingleFlight("semantic_search")
+image_embedding_flight = SingleFlight("image_embedding")
+
+IMAGE_EMBEDDING_MODEL_ID = "amazon.titan-embed-image-v1"
+IMAGE_EMBEDDING_DIMENSION = 1024
+
 def get_titan_embedding(text: str) -> list:
+    """Get embeddings, sharing one Titan call between concurrent requests for the same text"""
+    return embedding_flight.do(text, _get_titan_embedding, text)
+
+def _get_titan_embedding(text: str) -> list:
     """Get embeddings with proper error handling"""
     try:
-        AWS_DEFAULT_REGION = os.environ["AWS_DEFAULT_REGION"]
-        AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
-        AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
-        bedrock = boto3.client(
-            'bedrock-runtime', 
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_DEFAULT_REGION
-        )
+        # Reuse the shared client; building one per call cost a credential/endpoint resolution each time
+        bedrock = get_bedrock_client()
         
         payload = {"inputText": text}
         
-        response = bedrock.invoke_model(
-            modelId="amazon.titan-embed-text-v2:0",
-            body=json.dumps(payload),
-            contentType='application/json'
-        )
-        
-        result = json.loads(response['body'].read())
+        with tracer.start_as_current_span("bedrock.invoke_model.embedding") as span, stage_timer(STAGE_EMBEDDING):
+            response = call_bedrock(
+                "amazon.titan-embed-text-v2:0", bedrock.invoke_model,
+                modelId="amazon.titan-embed-text-v2:0",
+                body=json.dumps(payload),
+                contentType='application/json'
+            )
+            result = json.loads(response['body'].read())
+            span.set_attribute("gen_ai.request.model", "amazon.titan-embed-text-v2:0")
+            span.set_attribute("gen_ai.usage.input_tokens", result.get("inputTextTokenCount", 0))
         
         if 'embedding' not in result:
             print(f"No embedding in response: {result}")
@@ -527,10 +634,57 @@ def get_titan_embedding(text: str) -> list:
         #print(f"Got embedding with {len(embedding)} dimensions")
         return embedding
         
+    except ServiceOverloaded:
+        raise
     except Exception as e:
         print(f"Error getting embedding: {e}")
         return None
 
+def read_file_from_s3(path_to_file_s3: str) -> bytes:
+    """Read an uploaded object straight into memory"""
+    with tracer.start_as_current_span("s3.get_object") as span, stage_timer(STAGE_S3_DOWNLOAD):
+        span.set_attribute("s3.bucket", AWS_S3_BUCKET_NAME or "")
+        span.set_attribute("s3.key", path_to_file_s3)
+        try:
+            response = get_s3_client().get_object(Bucket=AWS_S3_BUCKET_NAME, Key=path_to_file_s3)
+        except Exception as e:
+            record_upstream_error("s3", e)
+            raise
+        return response['Body'].read()
+
+def get_titan_image_embedding(image_bytes: bytes) -> list:
+    """Get a multimodal image embedding, sharing one Titan call between concurrent requests for the same image"""
+    return image_embedding_flight.do(hashlib.sha1(image_bytes).hexdigest(), _get_titan_image_embedding, image_bytes)
+
+def _get_titan_image_embedding(image_bytes: bytes) -> list:
+    """Embed an image into the same space as the catalogue's vector_image field"""
+    try:
+        payload = {
+            "inputImage": base64.b64encode(image_bytes).decode("utf-8"),
+            "embeddingConfig": {"outputEmbeddingLength": IMAGE_EMBEDDING_DIMENSION}
+        }
+        with tracer.start_as_current_span("bedrock.invoke_model.image_embedding") as span, stage_timer(STAGE_EMBEDDING):
+            response = call_bedrock(
+                IMAGE_EMBEDDING_MODEL_ID, get_bedrock_client().invoke_model,
+                modelId=IMAGE_EMBEDDING_MODEL_ID,
+                body=json.dumps(payload),
+                contentType='application/json'
+            )
+            result = json.loads(response['body'].read())
+            span.set_attribute("gen_ai.request.model", IMAGE_EMBEDDING_MODEL_ID)
+
+        embedding = result.get('embedding')
+        if not embedding:
+            print(f"No image embedding in response: {result.get('message')}")
+            return None
+        return embedding
+
+    except ServiceOverloaded:
+        raise
+    except Exception as e:
+        print(f"Error getting image embedding: {e}")
+        return None
+
 
 # def fuzzy_search(index_name, search_term):
 #     print("\nFuzzy search\n")
@@ -555,6 +709,20 @@ def get_titan_embedding(text: str) -> list:
 #         print("---")
 
 def semantic_search(search_term, client, top_k=3, index_name="product-index"):
+    """
+    Perform a semantic search, sharing one embedding + kNN round trip between
+    concurrent requests for the same (term, k, index). See _semantic_search.
+
+    Results are cached until ingestion changes the index's catalogue version, so a
+    repeated query costs neither a Titan call nor a cluster round trip.
+    """
+    key = (search_term, top_k, index_name, id(client))
+    return search_cache.get_or_search(
+        search_term, top_k, index_name, client,
+        lambda: search_flight.do(key, _semantic_search, search_term, client, top_k, index_name)
+    )
+
+def _semantic_search(search_term, client, top_k=3, index_name="product-index"):
     """
     Perform a semantic search on the specified OpenSearch index using the given search term.
 
@@ -571,6 +739,7 @@ def semantic_search(search_term, client, top_k=3, index_name="product-index"):
     # Semantic search in OpenSearch
     vector_query = {
         "size": top_k,
+        "_source": PRODUCT_SOURCE_FIELDS,
         "query": {
             "knn": {
                 "vector_en": {
@@ -582,18 +751,101 @@ def semantic_search(search_term, client, top_k=3, index_name="product-index"):
     }
 
     results = []
-    semantic_resp = client.search(index=index_name, body=vector_query)
+    with tracer.start_as_current_span("opensearch.knn_search") as span, stage_timer(STAGE_KNN_SEARCH):
+        span.set_attribute("search.term", search_term)
+        span.set_attribute("search.k", top_k)
+        span.set_attribute("db.opensearch.index", index_name)
+        try:
+            semantic_resp = client.search(index=index_name, body=vector_query)
+        except Exception as e:
+            record_upstream_error("opensearch", e)
+            raise
+        span.set_attribute("search.result_count", len(semantic_resp['hits']['hits']))
     
     for i, hit in enumerate(semantic_resp['hits']['hits'], 1):
         print("CURRENT SCORE: ", hit['_score'])
         if hit['_score'] > 0:  # You can adjust this threshold as needed
-            product = {
-                'score': hit['_score'],
-                'id': hit["_source"]["imageUrl"],
-                'name': hit['_source']['name'],
-                'description': hit['_source']['description'],
-                'price': hit['_source']['price'],
+            results.append(_hit_to_product(hit))
+
+    return results
+
+def _hit_to_product(hit):
+    return {
+        'score': hit['_score'],
+        'id': hit["_source"]["imageUrl"],
+        'name': hit['_source']['name'],
+        'description': hit['_source']['description'],
+        'price': hit['_source']['price'],
+        # Near-duplicates (e.g. colour variants) collapsed into this product at ingestion
+        'variants': hit['_source'].get('variants', []),
+    }
+
+def image_search(image_bytes, client, top_k=3, index_name="product-index"):
+    """
+    Find the catalogue products that look most like an image, by kNN on the products'
+    multimodal image embeddings. No captioning or query decomposition is involved.
+
+    Args:
+    image_bytes (bytes): The query image.
+    client: The OpenSearch client.
+    top_k (int, optional): The number of documents to retrieve from the OpenSearch database
+    index_name (str, optional): The name of the OpenSearch index to search.
+
+    Returns:
+    list: A list of dictionaries, each containing product information
+    """
+    embedding = get_titan_image_embedding(image_bytes)
+    if not embedding:
+        return []
+    vector_query = {
+        "size": top_k,
+        "_source": PRODUCT_SOURCE_FIELDS,
+        "query": {
+            "knn": {
+                "vector_image": {
+                    "vector": embedding,
+                    "k": top_k
+                }
             }
-            results.append(product)
+        }
+    }
+    with tracer.start_as_current_span("opensearch.knn_search.image") as span, stage_timer(STAGE_KNN_SEARCH):
+        span.set_attribute("search.k", top_k)
+        span.set_attribute("db.opensearch.index", index_name)
+        try:
+            resp = client.search(index=index_name, body=vector_query)
+        except Exception as e:
+            record_upstream_error("opensearch", e)
+            raise
+        span.set_attribute("search.result_count", len(resp['hits']['hits']))
+    return [_hit_to_product(hit) for hit in resp['hits']['hits'] if hit['_score'] > 0]
+
+def document_id(image_url):
+    """Document _id of a product; must match product_id() in INGESTION/index_mapping.py"""
+    return hashlib.sha1(image_url.encode("utf-8")).hexdigest()
+
+def get_products_by_ids(product_ids, client, index_name="product-index"):
+    """
+    Fetch catalogue products by their id (the imageUrl, as returned by semantic_search).
 
-    return results
\ No newline at end of file
+    Returns:
+    list: Product dictionaries in the order of product_ids; unknown ids are skipped
+    """
+    if not product_ids:
+        return []
+    # Exact lookups by document _id: no analysed matching, no near-miss ids
+    body = {"docs": [{"_id": document_id(product_id), "_source": PRODUCT_SOURCE_FIELDS} for product_id in product_ids]}
+    with tracer.start_as_current_span("opensearch.get_products") as span:
+        span.set_attribute("search.k", len(product_ids))
+        try:
+            resp = client.mget(index=index_name, body=body)
+        except Exception as e:
+            record_upstream_error("opensearch", e)
+            raise
+
+    by_id = {}
+    for doc in resp['docs']:
+        if doc.get('found'):
+            # An exact lookup has no relevance score
+            by_id[doc['_source']['imageUrl']] = _hit_to_product({**doc, '_score': 1.0})
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
@@ -0,0 +1,160 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Buckets tuned for LLM / vector search latencies (10ms .. 30s)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Pipeline stages we time inside the endpoints
+STAGE_S3_DOWNLOAD = "s3_download"
+STAGE_CAPTIONING = "captioning"
+STAGE_QUERY_DECOMPOSITION = "query_decomposition"
+STAGE_STYLE_COMPLEMENT = "style_complement"
+STAGE_EMBEDDING = "embedding"
+STAGE_KNN_SEARCH = "knn_search"
+STAGE_GENERATION = "generation"
+
+THROTTLE_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "429"}
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests per endpoint",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Number of HTTP requests currently being served",
+    ["endpoint"],
+)
+
+STAGE_LATENCY = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Latency of each pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total",
+    "Errors returned by upstream services",
+    ["service", "code"],
+)
+
+UPSTREAM_THROTTLES = Counter(
+    "upstream_throttles_total",
+    "Throttling responses returned by upstream services",
+    ["service"],
+)
+
+COALESCED_CALLS = Counter(
+    "singleflight_coalesced_total",
+    "Callers that shared an identical in-flight call instead of issuing their own",
+    ["call"],
+)
+
+SPECULATIVE_SEARCHES = Counter(
+    "pipeline_speculative_searches_total",
+    "Search terms run speculatively before the caption was known, by whether the final plan kept them",
+    ["outcome"],
+)
+
+BEDROCK_CONCURRENCY_LIMIT = Gauge(
+    "bedrock_concurrency_limit",
+    "Current adaptive concurrency limit per Bedrock model",
+    ["model"],
+)
+
+BEDROCK_REJECTED = Counter(
+    "bedrock_rejected_total",
+    "Bedrock calls failed fast instead of being sent",
+    ["model", "reason"],
+)
+
+CIRCUIT_STATE = Gauge(
+    "bedrock_circuit_state",
+    "1 for the current circuit breaker state of each Bedrock model",
+    ["model", "state"],
+)
+
+QUOTA_QUEUE_WAIT = Histogram(
+    "bedrock_quota_queue_wait_seconds",
+    "Time Bedrock calls spent queued for RPM/TPM quota",
+    ["model", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+
+QUOTA_QUEUE_DEPTH = Gauge(
+    "bedrock_quota_queue_depth",
+    "Bedrock calls waiting for quota per model",
+    ["model"],
+)
+
+REFERENCE_TOKENS = Counter(
+    "generation_reference_tokens_total",
+    "Estimated product-context tokens sent to generation, and tokens saved by the context builder",
+    ["kind"],
+)
+
+PROMPT_CACHE_TOKENS = Counter(
+    "bedrock_prompt_cache_tokens_total",
+    "Input tokens read from / written to the prompt cache (local_* are estimates for models without caching)",
+    ["model", "kind"],
+)
+
+FAST_PATH_DECISIONS = Counter(
+    "query_fast_path_decisions_total",
+    "Fast-path decisions: skipped_llm when serving, agree/false_positive/false_negative in shadow mode",
+    ["outcome"],
+)
+
+COMPLEMENT_LOOKUPS = Counter(
+    "complement_graph_lookups_total",
+    "style_complement requests served from the precomputed graph (hit) or sent to the LLM (miss)",
+    ["outcome"],
+)
+
+SEARCH_CACHE_LOOKUPS = Counter(
+    "search_result_cache_lookups_total",
+    "semantic_search result cache lookups: hit, miss, or bypass while the catalogue version is unknown",
+    ["outcome"],
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Observe the wall time of a pipeline stage, even if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+def record_upstream_error(service: str, error: Exception) -> None:
+    """
+    Count an error coming back from Bedrock / OpenSearch / S3.
+
+    Args:
+        service: "bedrock", "opensearch" or "s3"
+        error: The exception raised by the client
+    """
+    # Only reached on errors, so botocore stays off the import path
+    from botocore.exceptions import ClientError
+
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "Unknown")
+    else:
+        # opensearch-py TransportError carries the HTTP status as status_code
+        code = str(getattr(error, "status_code", type(error).__name__))
+
+    UPSTREAM_ERRORS.labels(service=service, code=code).inc()
+    if code in THROTTLE_ERROR_CODES:
+        UPSTREAM_THROTTLES.labels(service=service).inc()
+
+
+def render_metrics():
+    """Return the Prometheus text exposition and its content type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
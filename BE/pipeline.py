@@ -0,0 +1,414 @@
+import os
+import json
+import asyncio
+import logging
+import tempfile
+from typing import List, Dict, Any
+
+from function import (chat_with_bedrock, image_to_text, download_file_from_s3, function_calling_with_bedrock,
+                      semantic_search, get_presigned_image_url, get_products_by_ids, read_file_from_s3, image_search)
+from context_builder import build_reference
+from metrics import stage_timer, STAGE_QUERY_DECOMPOSITION, STAGE_STYLE_COMPLEMENT, STAGE_GENERATION, SPECULATIVE_SEARCHES, FAST_PATH_DECISIONS
+from fast_path import fast_path_terms, record_decomposition, FAST_PATH_MODE
+from resilience import ServiceOverloaded
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+CAPTION_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+NO_IMAGE_CAPTION = "No image provided"
+NO_REFERENCE_RESPONSE = "Hello, I am a Customer Service Assistant. Please provide a query with relevant product context."
+
+PRODUCT_MATCHING = "product_matching"
+STYLE_MATCHING = "style_matching"
+
+# Start decomposition + search on the text-only plan while the image is still being captioned
+SPECULATIVE_SEARCH = os.environ.get("SPECULATIVE_SEARCH", "true").lower() == "true"
+
+STYLE_COMPLEMENT_SYSTEM_PROMPT = (
+    "You are a fashion recommendation assistant. The user will provide a fashion item they already have and ask for something that complements it. "
+    "Your job is to return 5–7 **search queries** in JSON array format, based ONLY on what the user is requesting (e.g., if they ask for 'shorts to go with my shirt', suggest shorts). "
+    "\n\nRules:\n"
+    "1. Identify the item the user ALREADY OWNS from their message.\n"
+    "2. Identify the item the user WANTS — this is what you will recommend.\n"
+    "3. Do NOT return search queries for the item they already own.\n"
+    "4. If any color, fabric, or style is mentioned, use that to enrich the query.\n"
+    "5. If the item they already own has a cultural, bohemian, or ethnic vibe, ensure your suggestions stylistically align.\n"
+    "6. Return ONLY a JSON array of strings. No markdown, no prose, no formatting."
+)
+
+DECOMPOSITION_SYSTEM_PROMPT = (
+    "Instructions:\n"
+    "- Identify all distinct product mentions from the latest user message.\n"
+    "- Generate exactly one simple query per item, staying close to user phrasing.\n"
+    "- Return output as a JSON array of strings."
+)
+
+GENERATION_SYSTEM_PROMPT = (
+    "You are a helpful customer service assistant. Answer the user's question based only on the provided product information. "
+    "Recommend general dress styles that might suit the user's need, without mentioning specific product names. "
+    "Keep your tone warm and human-like, and avoid bullet points or numbered lists. "
+    "Suggest the user explore the search results for specific items. "
+    "If there isn’t enough information to answer, say 'I don't know.'"
+)
+
+
+async def caption_image(image_path: str) -> str:
+    """
+    Download an uploaded image from S3 and caption it with Claude.
+
+    Args:
+        image_path: S3 key of the image ("" means no image)
+
+    Returns:
+        str: The caption, or NO_IMAGE_CAPTION if there is no image
+    """
+    if not image_path:
+        return NO_IMAGE_CAPTION
+
+    # One file per request so concurrent captions don't overwrite each other
+    fd, local_path = tempfile.mkstemp(suffix=".png", dir="images")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(download_file_from_s3, image_path, local_path)
+        return await image_to_text(CAPTION_MODEL_ID,
+                                   "Please describe the content of this image in detail",
+                                   input_image=local_path)
+    finally:
+        os.remove(local_path)
+
+
+async def decompose_query(user_query: str, image_prompt: str, record: bool = True) -> List[str]:
+    """
+    Turn the chat history and image context into one simple search query per product.
+    Falls back to the raw query if the tool-use model is shedding load.
+
+    Simple single-product queries ("black sequin skirt") skip the LLM entirely when
+    FAST_PATH_MODE=on and the local classifier is confident.
+
+    record=False keeps the call out of the training log and the shadow-mode stats; for
+    calls whose image context is a placeholder rather than what the user sent.
+    """
+    fast_terms = fast_path_terms(user_query, image_prompt)
+    if fast_terms is not None and FAST_PATH_MODE == "on":
+        FAST_PATH_DECISIONS.labels(outcome="skipped_llm").inc()
+        return fast_terms
+
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "text": (
+                        f"Chat history: {user_query}\n"
+                        f"Image context: {image_prompt}"
+                    )
+                }
+            ]
+        }
+    ]
+    try:
+        response = await function_calling_with_bedrock(messages, system=DECOMPOSITION_SYSTEM_PROMPT)
+        search_term = response["choices"][0]["message"]["content"]
+    except ServiceOverloaded as e:
+        # Degrade to the fast-path guess or the raw query rather than failing the whole request
+        logger.warning(f"Query decomposition unavailable, searching raw query: {e}")
+        return fast_terms or [user_query]
+
+    if isinstance(search_term, str):
+        search_term = json.loads(search_term)  # list of strings
+    if record:
+        record_decomposition(user_query, image_prompt, search_term["response"], fast_terms)
+    return search_term["response"]
+
+
+async def complement_queries(user_query: str) -> str:
+    """Ask Claude for 5-7 search queries that complement what the user already owns (JSON array as text)"""
+    messages = [
+        {"role": "system", "content": STYLE_COMPLEMENT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_query}
+    ]
+    with stage_timer(STAGE_STYLE_COMPLEMENT):
+        response = await chat_with_bedrock(messages)
+    search_term = response["choices"][0]["message"]["content"]
+    logger.info(f"Generated queries: {search_term}")
+    return search_term
+
+
+async def search_terms(terms: List[str], client, top_k: int = 3) -> List[Dict[str, Any]]:
+    """Run one semantic search per term in parallel threads"""
+    async def search(term):
+        # asyncio.to_thread copies contextvars, so the kNN spans nest under this one
+        with tracer.start_as_current_span("semantic_search") as span:
+            span.set_attribute("search.term", term)
+            result = await asyncio.to_thread(semantic_search, term, client, top_k=top_k)
+            span.set_attribute("search.result_count", len(result))
+        return {
+            "search_term": term,
+            "search_results": result
+        }
+
+    with tracer.start_as_current_span("semantic_search.gather") as span:
+        span.set_attribute("search.fanout", len(terms))
+        return list(await asyncio.gather(*(search(term) for term in terms)))
+
+
+async def search_by_image(image_path: str, client, top_k: int = 3) -> Dict[str, Any]:
+    """
+    Search the catalogue with an uploaded photo directly: one image embedding and one kNN
+    on vector_image, instead of caption -> decomposition -> text search.
+
+    Returns:
+        dict: DocumentResult-shaped {"search_term": image_path, "search_results": [...]}
+    """
+    with tracer.start_as_current_span("image_search") as span:
+        span.set_attribute("search.k", top_k)
+        image_bytes = await asyncio.to_thread(read_file_from_s3, image_path)
+        result = await asyncio.to_thread(image_search, image_bytes, client, top_k=top_k)
+        span.set_attribute("search.result_count", len(result))
+    return {
+        "search_term": image_path,
+        "search_results": result
+    }
+
+
+async def iter_search_terms(terms: List[str], client, top_k: int = 3):
+    """
+    Like search_terms, but yield each term's result as soon as its embedding and kNN finish.
+    A failed term yields {"search_term": ..., "error": ...} instead of aborting the rest.
+    """
+    async def search(term):
+        try:
+            result = await asyncio.to_thread(semantic_search, term, client, top_k=top_k)
+            return {"search_term": term, "search_results": result}
+        except Exception as e:
+            logger.error(f"Search failed for term {term!r}: {e}")
+            return {"search_term": term, "error": str(e)}
+
+    tasks = [asyncio.ensure_future(search(term)) for term in terms]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The client went away or a term was shed: don't leave searches running for nobody
+        for task in tasks:
+            task.cancel()
+
+
+async def resolve_reference(reference: str, search_results: List[Dict[str, Any]], product_ids: List[str], client):
+    """
+    Pick the product context for a generation call.
+
+    Structured search results or product ids go through the token-budgeted context builder;
+    a plain reference string is passed through untouched for older clients.
+
+    Returns:
+        tuple: (reference text, builder stats or None)
+    """
+    if not search_results and not product_ids:
+        return reference, None
+    products = await asyncio.to_thread(get_products_by_ids, product_ids, client) if product_ids else []
+    return build_reference(search_results=search_results, products=products)
+
+
+async def generate_answer(question: str, reference: str) -> str:
+    """Write the shopper-facing answer grounded on the reference product information"""
+    if not reference:
+        return NO_REFERENCE_RESPONSE
+
+    messages = [
+        {"role": "system", "content": GENERATION_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                f"Based on this product information: {reference}\n\n"
+                f"And this question: {question}\n\n"
+                f"Please give a short, natural-sounding response following the instructions."
+            )
+        }
+    ]
+    with stage_timer(STAGE_GENERATION):
+        response = await chat_with_bedrock(messages)
+    return response["choices"][0]["message"]["content"]
+
+
+class Stage:
+    """
+    A node in the pipeline DAG.
+
+    fn is an async callable taking one keyword argument per dependency,
+    named after the dependency and bound to its result.
+    """
+
+    def __init__(self, name: str, fn, deps=()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+
+async def run_dag(stages: List[Stage]) -> Dict[str, Any]:
+    """
+    Run every stage as soon as its dependencies finish, so independent branches overlap
+    and end-to-end latency tracks the longest path rather than the sum of stages.
+
+    Returns:
+        dict: stage name -> result
+
+    Raises:
+        ValueError: unknown dependency or a cycle
+        Exception: the first stage failure (all other stages are cancelled)
+    """
+    by_name = {stage.name: stage for stage in stages}
+    visiting, done = set(), set()
+
+    def check(name):
+        if name not in by_name:
+            raise ValueError(f"Unknown pipeline stage: {name}")
+        if name in visiting:
+            raise ValueError(f"Cycle in pipeline at stage: {name}")
+        if name in done:
+            return
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            check(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for stage in stages:
+        check(stage.name)
+
+    tasks = {}
+
+    async def run(stage):
+        inputs = {dep: await tasks[dep] for dep in stage.deps}
+        with tracer.start_as_current_span(f"pipeline.{stage.name}"):
+            return await stage.fn(**inputs)
+
+    # Every task exists before any of them runs, so run() can always find its dependencies
+    for stage in stages:
+        tasks[stage.name] = asyncio.ensure_future(run(stage))
+    try:
+        results = await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return dict(zip(tasks, results))
+
+
+def _parse_terms(text: str) -> List[str]:
+    """Best-effort parse of a JSON array of queries; [] if the model returned anything else"""
+    try:
+        terms = json.loads(text)
+    except (TypeError, ValueError):
+        return []
+    return [term for term in terms if isinstance(term, str)] if isinstance(terms, list) else []
+
+
+async def _merge_speculative(terms: List[str], speculative: List[Dict[str, Any]], client) -> List[Dict[str, Any]]:
+    """
+    Reuse speculative search results for terms the final plan kept, search the rest,
+    and drop speculative results the final plan no longer wants.
+    """
+    done = {doc["search_term"].strip().lower(): doc for doc in speculative}
+    missing = [term for term in terms if term.strip().lower() not in done]
+    fresh = {doc["search_term"]: doc for doc in await search_terms(missing, client)} if missing else {}
+
+    # Distinct speculative results used; the plan may repeat a term or vary its case
+    kept = len({term.strip().lower() for term in terms} & done.keys())
+    SPECULATIVE_SEARCHES.labels(outcome="reused").inc(kept)
+    SPECULATIVE_SEARCHES.labels(outcome="discarded").inc(max(0, len(done) - kept))
+
+    return [
+        fresh[term] if term in fresh else {**done[term.strip().lower()], "search_term": term}
+        for term in terms
+    ]
+
+
+async def run_assist(image_path: str, user_query: str, feature: str, client) -> Dict[str, Any]:
+    """
+    Run the whole shopping flow in-process as a DAG: caption -> (style complement) -> search -> generation.
+    Mirrors DEMO/product_matching.py and DEMO/style_matching.py without the HTTP hops.
+
+    The style complement never needs the caption, so it runs alongside captioning. When
+    SPECULATIVE_SEARCH is on and there is an image, the text-only plan is searched while the
+    image is captioned; once the real plan is known, matching terms reuse those results and
+    the rest are discarded.
+
+    Returns:
+        dict: caption, complement (style matching only), results, response, context and image_url
+    """
+    has_image = bool(image_path)
+    speculate = SPECULATIVE_SEARCH and has_image
+
+    async def caption():
+        return await caption_image(image_path)
+
+    async def image_url():
+        return get_presigned_image_url(image_path) if has_image else None
+
+    async def complement():
+        return await complement_queries(user_query) if feature == STYLE_MATCHING else None
+
+    def plan_query(complement):
+        return complement if complement is not None else user_query
+
+    async def speculative_terms(complement):
+        if feature == STYLE_MATCHING:
+            # The complement is already a list of queries; bet that decomposition keeps them
+            return _parse_terms(complement)
+        try:
+            # The real caption isn't known yet, so this isn't a decomposition worth learning from
+            return await decompose_query(user_query, NO_IMAGE_CAPTION, record=False)
+        except Exception as e:
+            logger.warning(f"Speculative decomposition failed: {e}")
+            return []
+
+    async def speculative_search(speculative_terms):
+        # A failed bet only costs the reuse, never the request
+        try:
+            return await search_terms(speculative_terms, client)
+        except Exception as e:
+            logger.warning(f"Speculative search failed, falling back to the final plan: {e}")
+            return []
+
+    async def terms(caption, complement):
+        return await decompose_query(plan_query(complement), caption)
+
+    async def search(terms, speculative_search):
+        return await _merge_speculative(terms, speculative_search, client)
+
+    async def search_only(terms):
+        return await search_terms(terms, client)
+
+    async def generation(search):
+        reference, context = build_reference(search_results=search)
+        return await generate_answer(user_query, reference), context
+
+    stages = [
+        Stage("caption", caption),
+        Stage("image_url", image_url),
+        Stage("complement", complement),
+        Stage("terms", terms, deps=("caption", "complement")),
+        Stage("generation", generation, deps=("search",)),
+    ]
+    if speculate:
+        stages += [
+            Stage("speculative_terms", speculative_terms, deps=("complement",)),
+            Stage("speculative_search", speculative_search, deps=("speculative_terms",)),
+            Stage("search", search, deps=("terms", "speculative_search")),
+        ]
+    else:
+        stages.append(Stage("search", search_only, deps=("terms",)))
+
+    results = await run_dag(stages)
+    response, context = results["generation"]
+
+    return {
+        "caption": results["caption"],
+        "complement": results["complement"],
+        "results": results["search"],
+        "response": response,
+        "context": context,
+        "image_url": results["image_url"],
+    }
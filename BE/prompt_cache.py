@@ -0,0 +1,65 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from metrics import PROMPT_CACHE_TOKENS
+
+# Models whose Converse API accepts cachePoint blocks
+PROMPT_CACHE_MODELS = {
+    "anthropic.claude-3-5-haiku-20241022-v1:0",
+    "anthropic.claude-3-7-sonnet-20250219-v1:0",
+    "anthropic.claude-sonnet-4-20250514-v1:0",
+}
+
+# Bedrock keeps cached prefixes for ~5 minutes; the local stand-in just remembers recent prefixes
+_LOCAL_CACHE_SIZE = 256
+
+_seen_prefixes = OrderedDict()
+_seen_lock = threading.Lock()
+
+
+def supports_prompt_cache(model_id: str) -> bool:
+    return model_id in PROMPT_CACHE_MODELS
+
+
+def with_cache_point(blocks: list, model_id: str) -> list:
+    """Append a cache checkpoint after a static prefix (system blocks or tools) when the model supports it"""
+    if supports_prompt_cache(model_id):
+        return blocks + [{"cachePoint": {"type": "default"}}]
+    return blocks
+
+
+def _local_lookup(model_id: str, prefix: str) -> bool:
+    """True if this exact prefix was sent to this model recently"""
+    key = hashlib.sha256(f"{model_id}\0{prefix}".encode()).hexdigest()
+    with _seen_lock:
+        hit = key in _seen_prefixes
+        _seen_prefixes[key] = True
+        _seen_prefixes.move_to_end(key)
+        if len(_seen_prefixes) > _LOCAL_CACHE_SIZE:
+            _seen_prefixes.popitem(last=False)
+    return hit
+
+
+def record_cache_usage(span, model_id: str, response: dict, prefix: str) -> None:
+    """
+    Report cache-read vs cache-write input tokens for a converse call.
+
+    For models with prompt caching the numbers come from Bedrock's usage block. For the
+    rest we account locally: the first time a prefix is seen it counts as a write, later
+    as a read, estimated at ~4 characters per token.
+    """
+    if supports_prompt_cache(model_id):
+        usage = response.get("usage", {})
+        read = usage.get("cacheReadInputTokens", 0)
+        write = usage.get("cacheWriteInputTokens", 0)
+        PROMPT_CACHE_TOKENS.labels(model=model_id, kind="read").inc(read)
+        PROMPT_CACHE_TOKENS.labels(model=model_id, kind="write").inc(write)
+    else:
+        tokens = len(prefix) // 4
+        hit = _local_lookup(model_id, prefix)
+        read, write = (tokens, 0) if hit else (0, tokens)
+        PROMPT_CACHE_TOKENS.labels(model=model_id, kind="local_read" if hit else "local_write").inc(tokens)
+
+    span.set_attribute("gen_ai.usage.cache_read_input_tokens", read)
+    span.set_attribute("gen_ai.usage.cache_write_input_tokens", write)
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from metrics import QUOTA_QUEUE_WAIT, QUOTA_QUEUE_DEPTH
+
+# Lower value is served first
+PRIORITY_STREAMING = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_NAMES = {PRIORITY_STREAMING: "streaming", PRIORITY_INTERACTIVE: "interactive"}
+
+# Requests / tokens per minute per model. Override with BEDROCK_QUOTAS='{"model-id": {"rpm": .., "tpm": ..}}'
+# These budget this backend process only: batch ingestion and the upload Lambda call Bedrock
+# from their own processes, so set these to the share of the account quota left for serving.
+DEFAULT_QUOTAS = {
+    "anthropic.claude-3-haiku-20240307-v1:0": {"rpm": 400, "tpm": 300000},
+    "anthropic.claude-3-5-haiku-20241022-v1:0": {"rpm": 400, "tpm": 300000},
+    "amazon.titan-embed-text-v2:0": {"rpm": 2000, "tpm": 300000},
+    "amazon.titan-embed-image-v1": {"rpm": 2000, "tpm": 300000},
+}
+FALLBACK_QUOTA = {"rpm": 100, "tpm": 100000}
+# Upper bound on queueing for callers without a request deadline
+MAX_QUEUE_SECONDS = float(os.environ.get("BEDROCK_MAX_QUEUE_SECONDS", "60"))
+
+_priority = contextvars.ContextVar("bedrock_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """Run the enclosed Bedrock calls at the given scheduling priority"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def load_quotas() -> dict:
+    quotas = dict(DEFAULT_QUOTAS)
+    quotas.update(json.loads(os.environ.get("BEDROCK_QUOTAS", "{}")))
+    return quotas
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at capacity per minute"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (0 if it is available now)"""
+        self._refill()
+        # A single request larger than the bucket would wait forever; let it through once full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class QuotaScheduler:
+    """
+    Admit Bedrock calls against each model's RPM and TPM buckets.
+
+    Callers queue per model in (priority, arrival) order; only the head of a model's
+    queue may take from its buckets, so a later request can never jump ahead of a
+    waiting streaming one.
+    """
+
+    def __init__(self, quotas: dict):
+        self.quotas = quotas
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._queues = {}
+        self._seq = itertools.count()
+
+    def _buckets_for(self, model_id: str):
+        if model_id not in self._buckets:
+            quota = self.quotas.get(model_id, FALLBACK_QUOTA)
+            self._buckets[model_id] = (TokenBucket(quota["rpm"]), TokenBucket(quota["tpm"]))
+            self._queues[model_id] = []
+        return self._buckets[model_id]
+
+    def acquire(self, model_id: str, est_tokens: int, timeout: float) -> bool:
+        """
+        Block until model_id has room for one request of est_tokens, or timeout expires.
+
+        Returns:
+            True if admitted, False on timeout
+        """
+        level = current_priority()
+        start = time.monotonic()
+        deadline = start + min(timeout, MAX_QUEUE_SECONDS)
+
+        with self._cond:
+            requests, tokens = self._buckets_for(model_id)
+            queue = self._queues[model_id]
+            entry = (level, next(self._seq))
+            heapq.heappush(queue, entry)
+            QUOTA_QUEUE_DEPTH.labels(model=model_id).set(len(queue))
+            try:
+                while True:
+                    if queue[0] == entry:
+                        wait = max(requests.wait_time(1), tokens.wait_time(est_tokens))
+                        if wait == 0:
+                            requests.take(1)
+                            tokens.take(est_tokens)
+                            return True
+                    else:
+                        wait = None
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        return False
+                    self._cond.wait(left if wait is None else min(wait, left))
+            finally:
+                queue.remove(entry)
+                heapq.heapify(queue)
+                QUOTA_QUEUE_DEPTH.labels(model=model_id).set(len(queue))
+                QUOTA_QUEUE_WAIT.labels(model=model_id, priority=PRIORITY_NAMES[level]).observe(
+                    time.monotonic() - start
+                )
+                self._cond.notify_all()
+
+    def release(self, model_id: str, est_tokens: int) -> None:
+        """Return an admission that was never used to call the model"""
+        with self._cond:
+            requests, tokens = self._buckets_for(model_id)
+            requests.give_back(1)
+            tokens.give_back(est_tokens)
+            self._cond.notify_all()
+
+    def reconcile(self, model_id: str, est_tokens: int, actual_tokens: int) -> None:
+        """Correct the token bucket once the real usage of an admitted call is known"""
+        with self._cond:
+            _, tokens = self._buckets_for(model_id)
+            if actual_tokens > est_tokens:
+                tokens.take(actual_tokens - est_tokens)
+            else:
+                tokens.give_back(est_tokens - actual_tokens)
+            self._cond.notify_all()
+
+
+def estimate_tokens(request: dict) -> int:
+    """
+    Rough token estimate (~4 characters per token) for a converse/invoke_model request.
+    Like Bedrock itself, reserve maxTokens for the output up front.
+    """
+    chars = 0
+    for block in request.get("system", []):
+        chars += len(block.get("text", ""))
+    for message in request.get("messages", []):
+        for block in message.get("content", []):
+            chars += len(block.get("text", ""))
+            if "image" in block:
+                chars += 1600 * 4  # a typical photo costs ~1.6k tokens
+    if "body" in request:
+        if request["body"].startswith('{"inputImage"'):
+            chars += 1600 * 4  # base64 image bytes aren't tokens
+        else:
+            chars += len(request["body"])
+    return chars // 4 + request.get("inferenceConfig", {}).get("maxTokens", 0)
+
+
+scheduler = QuotaScheduler(load_quotas())
@@ -0,0 +1,246 @@
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+
+from metrics import record_upstream_error, BEDROCK_CONCURRENCY_LIMIT, BEDROCK_REJECTED, CIRCUIT_STATE
+from quota import scheduler, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "25"))
+BEDROCK_INITIAL_CONCURRENCY = int(os.environ.get("BEDROCK_INITIAL_CONCURRENCY", "4"))
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get("BEDROCK_MAX_CONCURRENCY", "32"))
+BEDROCK_MAX_RETRIES = int(os.environ.get("BEDROCK_MAX_RETRIES", "3"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "10"))
+
+BACKOFF_BASE_SECONDS = 0.2
+BACKOFF_CAP_SECONDS = 4.0
+
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException"}
+RETRYABLE_CODES = THROTTLE_CODES | {"ServiceUnavailableException", "ModelNotReadyException", "InternalServerException"}
+
+# Absolute time.monotonic() by which the current request must finish
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class ServiceOverloaded(Exception):
+    """Raised instead of calling Bedrock when the model is throttled, the circuit is open or the deadline is spent"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def set_request_deadline(seconds: float = REQUEST_DEADLINE_SECONDS):
+    """Start the deadline clock for the current request; returns the contextvar token"""
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def remaining_time() -> float:
+    """Seconds left before the request deadline (infinite outside a request)"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return float("inf")
+    return deadline - time.monotonic()
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: grow by ~1 slot per limit's worth of successes,
+    halve on every throttle.
+    """
+
+    def __init__(self, name: str, initial: int = BEDROCK_INITIAL_CONCURRENCY,
+                 min_limit: int = 1, max_limit: int = BEDROCK_MAX_CONCURRENCY):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        BEDROCK_CONCURRENCY_LIMIT.labels(model=name).set(self.limit)
+
+    def acquire(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for a free slot; False if none opened up"""
+        if timeout == float("inf"):
+            timeout = None
+        else:
+            timeout = max(timeout, 0)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < int(self.limit), timeout=timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def cancel(self) -> None:
+        """Give back a slot that was never used; says nothing about the model's capacity"""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def release(self, throttled: bool = False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            BEDROCK_CONCURRENCY_LIMIT.labels(model=self.name).set(self.limit)
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURE_THRESHOLD consecutive throttles/failures and fails fast
+    for BREAKER_RESET_SECONDS, then lets a single probe call through (half-open).
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        for s in (self.CLOSED, self.OPEN, self.HALF_OPEN):
+            CIRCUIT_STATE.labels(model=self.name, state=s).set(1 if s == state else 0)
+
+    def rejecting(self) -> bool:
+        """True while allow() would refuse; unlike allow(), never starts a probe"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at < self.reset_seconds
+            return self.state == self.HALF_OPEN
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self._set_state(self.HALF_OPEN)
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for {self.name} closed")
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guards(model_id: str):
+    """Return the (limiter, breaker) pair for a model, creating it on first use"""
+    with _guards_lock:
+        if model_id not in _guards:
+            _guards[model_id] = (AdaptiveLimiter(model_id), CircuitBreaker(model_id))
+        return _guards[model_id]
+
+
+def call_bedrock(model_id: str, fn, *args, **kwargs):
+    """
+    Call a Bedrock client method under the model's RPM/TPM quota, concurrency limit and
+    circuit breaker, retrying throttles and transient errors with full-jitter backoff inside
+    the request deadline.
+
+    Args:
+        model_id: Model the call is billed against (limits are per model)
+        fn: Bound client method, e.g. bedrock_client.converse
+
+    Returns:
+        Whatever fn returns
+
+    Raises:
+        ServiceOverloaded: circuit open, no quota or slot before the deadline, or retries exhausted
+    """
+    # By the time anything calls Bedrock, boto3 (and so botocore) is loaded anyway
+    from botocore.exceptions import ClientError
+
+    limiter, breaker = get_guards(model_id)
+    est_tokens = estimate_tokens(kwargs)
+
+    for attempt in range(BEDROCK_MAX_RETRIES + 1):
+        # Fail fast without queueing while the circuit is open
+        if breaker.rejecting():
+            BEDROCK_REJECTED.labels(model=model_id, reason="circuit_open").inc()
+            raise ServiceOverloaded(f"{model_id} is temporarily unavailable", retry_after=breaker.retry_after())
+
+        if not scheduler.acquire(model_id, est_tokens, timeout=remaining_time()):
+            BEDROCK_REJECTED.labels(model=model_id, reason="quota").inc()
+            raise ServiceOverloaded(f"{model_id} is over its request/token quota")
+
+        if not limiter.acquire(timeout=remaining_time()):
+            scheduler.release(model_id, est_tokens)
+            BEDROCK_REJECTED.labels(model=model_id, reason="concurrency").inc()
+            raise ServiceOverloaded(f"{model_id} is at its concurrency limit")
+
+        # Last, so a half-open probe is only started by a call that is about to be made
+        # and always ends in record_success or record_failure below
+        if not breaker.allow():
+            limiter.cancel()
+            scheduler.release(model_id, est_tokens)
+            BEDROCK_REJECTED.labels(model=model_id, reason="circuit_open").inc()
+            raise ServiceOverloaded(f"{model_id} is temporarily unavailable", retry_after=breaker.retry_after())
+
+        throttled = False
+        try:
+            result = fn(*args, **kwargs)
+        except ClientError as e:
+            record_upstream_error("bedrock", e)
+            code = e.response.get("Error", {}).get("Code")
+            throttled = code in THROTTLE_CODES
+            if code not in RETRYABLE_CODES:
+                # Bedrock answered, the request itself was bad: not a health signal against the model
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            last_error = e
+        except Exception as e:
+            # Timeouts and connection errors (BotoCoreError) never reached the model
+            record_upstream_error("bedrock", e)
+            breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+            if "usage" in result:
+                scheduler.reconcile(model_id, est_tokens, result["usage"].get("totalTokens", est_tokens))
+            return result
+        finally:
+            limiter.release(throttled=throttled)
+
+        backoff = random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        if attempt == BEDROCK_MAX_RETRIES or backoff >= remaining_time():
+            break
+        logger.warning(f"Bedrock {model_id} returned {code}, retrying in {backoff:.2f}s")
+        time.sleep(backoff)
+
+    BEDROCK_REJECTED.labels(model=model_id, reason="retries_exhausted").inc()
+    raise ServiceOverloaded(f"{model_id} is throttled: {last_error}")
@@ -0,0 +1,72 @@
+import os
+import json
+import logging
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # in requirement.txt; stdlib json is the slower fallback
+    orjson = None
+
+# "gzip" (default), "br" (brotli, with gzip for clients that don't accept it) or "off"
+RESPONSE_COMPRESSION = os.environ.get("RESPONSE_COMPRESSION", "gzip").lower()
+# Below this a response fits in a packet or two; compressing it costs more than it saves
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+# Streamed frames must reach the client as they are written, not sit in a compressor buffer
+STREAMING_PATHS = {"/finding_documents_stream", "/generation_stream"}
+
+
+def _default(value: Any):
+    # Pydantic models nested in otherwise plain payloads
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON, via orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson.
+
+    Endpoints that build their payload themselves return one of these directly (a plain
+    dict already shaped like their response_model), which also skips FastAPI's
+    re-validation of the return value; response_model still documents the schema.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _compressor(app):
+    if RESPONSE_COMPRESSION == "br":
+        try:
+            from brotli_asgi import BrotliMiddleware
+            return BrotliMiddleware(app, minimum_size=COMPRESSION_MIN_BYTES, gzip_fallback=True)
+        except ImportError:
+            logger.warning("RESPONSE_COMPRESSION=br needs brotli-asgi; falling back to gzip")
+    return GZipMiddleware(app, minimum_size=COMPRESSION_MIN_BYTES)
+
+
+class CompressResponses:
+    """Compress buffered responses; STREAMING_PATHS pass through untouched"""
+
+    def __init__(self, app):
+        self.app = app
+        self.compressed = app if RESPONSE_COMPRESSION == "off" else _compressor(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in STREAMING_PATHS:
+            await self.compressed(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
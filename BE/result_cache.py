@@ -0,0 +1,133 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from metrics import SEARCH_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "10000"))
+# How often the catalogue version is re-read. Bounds staleness: for up to this long after
+# a bump, searches may still be answered from the previous version's cached results.
+VERSION_CHECK_SECONDS = float(os.environ.get("CATALOGUE_VERSION_CHECK_SECONDS", "5"))
+# Written to the index mapping's _meta by ingestion (INGESTION/index_mapping.py)
+CATALOGUE_VERSION_KEY = "catalogue_version"
+
+
+def normalize_term(term: str) -> str:
+    """Case and whitespace don't change the embedding enough to be worth a separate entry"""
+    return re.sub(r"\s+", " ", term).strip().lower()
+
+
+def search_key(term: str, top_k: int, index_name: str, version: str, filters: Any = None) -> str:
+    return hashlib.sha1(repr((normalize_term(term), top_k, index_name, filters, version)).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe bounded mapping; the least recently read entry is evicted first"""
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class CatalogueVersion:
+    """
+    The catalogue version of one index, polled from its mapping in the background.
+
+    None until the first poll succeeds, or when the index has no version; callers
+    must not cache anything then. A bump is noticed on the first poll after it, so
+    within VERSION_CHECK_SECONDS (plus the poll's own round trip).
+    """
+
+    def __init__(self, index_name: str):
+        self.index_name = index_name
+        self.version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _check(self, client) -> None:
+        try:
+            mapping = client.indices.get_mapping(index=self.index_name)
+            meta = next(iter(mapping.values()))["mappings"].get("_meta", {})
+            version = meta.get(CATALOGUE_VERSION_KEY)
+            if version != self.version:
+                logger.info(f"Catalogue version of {self.index_name}: {version}")
+            self.version = version
+        except Exception as e:
+            # Stop caching rather than keep serving a version we can no longer confirm
+            self.version = None
+            logger.error(f"Failed to read the catalogue version of {self.index_name}: {e}")
+        finally:
+            self._lock.release()
+
+    def get(self, client) -> Optional[str]:
+        """Current version; a stale one is refreshed in the background, never on the request path"""
+        now = time.monotonic()
+        if now - self._checked_at >= VERSION_CHECK_SECONDS and self._lock.acquire(blocking=False):
+            self._checked_at = now
+            threading.Thread(target=self._check, args=(client,), daemon=True).start()
+        return self.version
+
+
+class SearchResultCache:
+    """semantic_search results keyed by (normalized term, k, index, filters, catalogue version)"""
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_SIZE):
+        self.results = LRUCache(max_entries)
+        self.versions = {}
+        self._versions_lock = threading.Lock()
+
+    def version(self, index_name: str, client) -> Optional[str]:
+        with self._versions_lock:
+            tracker = self.versions.setdefault(index_name, CatalogueVersion(index_name))
+        return tracker.get(client)
+
+    def get_or_search(self, term, top_k, index_name, client, search, filters=None):
+        """
+        Cached results for the search, or run search() and cache what it returns.
+
+        Entries of older versions are never looked up again and age out of the LRU. Results
+        can be up to VERSION_CHECK_SECONDS stale after the catalogue changes (see CatalogueVersion).
+        """
+        version = self.version(index_name, client) if SEARCH_CACHE_SIZE > 0 else None
+        if version is None:
+            SEARCH_CACHE_LOOKUPS.labels(outcome="bypass").inc()
+            return search()
+        key = search_key(term, top_k, index_name, version, filters)
+        cached = self.results.get(key)
+        if cached is not None:
+            SEARCH_CACHE_LOOKUPS.labels(outcome="hit").inc()
+            # Callers own their result dicts
+            return [dict(product) for product in cached]
+        SEARCH_CACHE_LOOKUPS.labels(outcome="miss").inc()
+        results = search()
+        self.results.put(key, [dict(product) for product in results])
+        return results
+
+
+search_cache = SearchResultCache()
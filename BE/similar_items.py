@@ -0,0 +1,92 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Built (and refreshed in place) by INGESTION/similar.py
+SIMILAR_ITEMS_TABLE = os.environ.get("SIMILAR_ITEMS_TABLE", "similar_items.npz")
+RELOAD_CHECK_SECONDS = 30.0
+# Neighbours stored per product (INGESTION/similar.py --top-n); more can't be served
+MAX_SIMILAR_ITEMS = int(os.environ.get("MAX_SIMILAR_ITEMS", "20"))
+
+
+class SimilarItemsTable:
+    """Top-N neighbours per product as flat arrays; a lookup is one dict read and one row slice"""
+
+    def __init__(self, ids, names, prices, neighbors, scores):
+        self.ids = ids
+        self.names = names
+        self.prices = prices
+        self.neighbors = neighbors
+        self.scores = scores
+        self.row_by_id = {product_id: row for row, product_id in enumerate(ids.tolist())}
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            return cls(data["ids"], data["names"], data["prices"], data["neighbors"], data["scores"])
+
+    def similar(self, product_id: str, k: int) -> Optional[List[Dict]]:
+        row = self.row_by_id.get(product_id)
+        if row is None:
+            return None
+        results = []
+        for neighbor, score in zip(self.neighbors[row, :k].tolist(), self.scores[row, :k].tolist()):
+            if neighbor < 0:
+                break
+            results.append({
+                "id": str(self.ids[neighbor]),
+                "name": str(self.names[neighbor]),
+                "price": str(self.prices[neighbor]),
+                "score": score,
+            })
+        return results
+
+
+class SimilarItemsStore:
+    """Holds the current table and swaps in a new one when the job rewrites the file"""
+
+    def __init__(self, path: str = SIMILAR_ITEMS_TABLE):
+        self.path = path
+        self.table = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self._mtime is None:
+                logger.info(f"No similar-items table at {self.path}")
+            return
+        if mtime == self._mtime:
+            return
+        table = SimilarItemsTable.load(self.path)
+        self.table, self._mtime = table, mtime
+        logger.info(f"Loaded similar-items table with {len(table.ids)} products from {self.path}")
+
+    def _check(self) -> None:
+        try:
+            self.reload()
+        except Exception as e:
+            logger.error(f"Failed to reload {self.path}: {e}")
+        finally:
+            self._lock.release()
+
+    def get(self) -> Optional[SimilarItemsTable]:
+        """Current table; a changed file is loaded in the background, never on the request path"""
+        now = time.monotonic()
+        if now - self._checked_at >= RELOAD_CHECK_SECONDS and self._lock.acquire(blocking=False):
+            self._checked_at = now
+            threading.Thread(target=self._check, daemon=True).start()
+        return self.table
+
+
+store = SimilarItemsStore()
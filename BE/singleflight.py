@@ -0,0 +1,53 @@
+import threading
+from concurrent.futures import Future
+
+from metrics import COALESCED_CALLS
+
+
+class SingleFlight:
+    """
+    Collapse identical concurrent calls into one.
+
+    The first caller for a key runs the function; callers arriving with the same key
+    while it is still running block on the same future and get its result (or exception).
+    Nothing is cached once the call finishes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) unless a call with the same key is already in flight.
+
+        Args:
+            key: Hashable identity of the call
+            fn: The function to run if we are the first caller
+
+        Returns:
+            The result of fn, shared by every coalesced caller
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not is_leader:
+            COALESCED_CALLS.labels(call=self.name).inc()
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
@@ -0,0 +1,40 @@
+"""
+Error paths of the Bedrock wrappers, against a fake client (no AWS access needed).
+
+Run from BE/: python -m pytest -q test_function.py
+"""
+import os
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError, ReadTimeoutError
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import function  # noqa: E402
+
+
+class FailingBedrock:
+    def __init__(self, error):
+        self.error = error
+
+    def converse(self, **kwargs):
+        raise self.error
+
+
+def call_with(monkeypatch, error):
+    monkeypatch.setattr(function, "get_bedrock_client", lambda: FailingBedrock(error))
+    messages = [{"role": "user", "content": [{"text": "red dress"}]}]
+    return asyncio.run(function.function_calling_with_bedrock(messages))
+
+
+def test_validation_error_is_reported(monkeypatch):
+    error = ClientError({"Error": {"Code": "ValidationException", "Message": "bad input"}}, "Converse")
+    with pytest.raises(Exception, match="Invalid request parameters: bad input"):
+        call_with(monkeypatch, error)
+
+
+def test_connection_error_is_reported(monkeypatch):
+    error = ReadTimeoutError(endpoint_url="https://bedrock-runtime")
+    with pytest.raises(Exception, match="Chat error"):
+        call_with(monkeypatch, error)
@@ -41,6 +41,35 @@ def test_finding_documents():
         print(f"Error: {response.text}")
     print()
 
+def test_finding_documents_stream():
+    """Test the NDJSON streaming finding documents endpoint"""
+    print("=== Testing Finding Documents (Stream) ===")
+    
+    payload = {
+        "user_query": "I'm looking for a red dress and white sneakers for summer",
+        "image_prompt": "casual summer clothing"
+    }
+    
+    with requests.post(
+        f"{BASE_URL}/finding_documents_stream",
+        json=payload,
+        headers={"Content-Type": "application/json"},
+        stream=True
+    ) as response:
+        print(f"Status: {response.status_code}")
+        for line in response.iter_lines():
+            if not line:
+                continue
+            frame = json.loads(line)
+            if frame["type"] == "result":
+                print(f"  {frame['search_term']}: {len(frame['search_results'])} results")
+            elif frame["type"] == "error":
+                print(f"  {frame['search_term']}: failed ({frame['error']})")
+            else:
+                print(f"Time to first result: {frame['time_to_first_result']}")
+                print(f"Processing time: {frame['processing_time']:.2f}s")
+    print()
+
 def test_image_captioning():
     """Test the image captioning endpoint"""
     print("=== Testing Image Captioning ===")
@@ -117,6 +146,7 @@ def test_all_endpoints():
     
     test_health_check()
     test_finding_documents()
+    test_finding_documents_stream()
     test_image_captioning()
     test_generation()
     test_generation_no_reference()
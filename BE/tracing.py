@@ -0,0 +1,48 @@
+import os
+import logging
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "product-search-api"
+
+# "otlp" -> local collector, "file" -> JSON lines, "none" -> spans are created but dropped
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none")
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "http://localhost:4318/v1/traces")
+
+tracer = trace.get_tracer(SERVICE_NAME)
+
+
+def setup_tracing():
+    """
+    Install the global tracer provider and its exporter based on TRACE_EXPORTER.
+    Safe to call once at app startup.
+    """
+    provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+
+    if TRACE_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=OTLP_ENDPOINT)))
+        logger.info(f"Exporting traces to OTLP collector at {OTLP_ENDPOINT}")
+    elif TRACE_EXPORTER == "file":
+        exporter = ConsoleSpanExporter(
+            out=open(TRACE_FILE, "a"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        logger.info(f"Writing traces to {TRACE_FILE}")
+
+    trace.set_tracer_provider(provider)
+
+
+def set_bedrock_usage(span, model_id: str, response: dict) -> None:
+    """Attach model id and token usage from a Bedrock converse response to a span"""
+    usage = response.get("usage", {})
+    span.set_attribute("gen_ai.request.model", model_id)
+    span.set_attribute("gen_ai.usage.input_tokens", usage.get("inputTokens", 0))
+    span.set_attribute("gen_ai.usage.output_tokens", usage.get("outputTokens", 0))
@@ -0,0 +1,39 @@
+from util import post_request, trace_headers, filter_reference_documents
+import time
+
+
+def assist_matching(caption_payload, user_messages, features):
+    """
+    Perform product or style matching with a single call to /assist,
+    letting the server chain captioning, search and generation
+    """
+    start = time.time()
+    payload = {
+        "user_query": f'''{user_messages}''',
+        "image_path": caption_payload["image_path"],
+        "feature": features
+    }
+    result = post_request("assist", payload, headers=trace_headers(), timeout=45)
+    print(f"Image captioning result: {result['caption']}")
+    if result["complement"]:
+        print(f"Style complement result: {result['complement']}")
+
+    reference_final = filter_reference_documents(result["results"])
+    print(f"Reference documents: {reference_final}")
+
+    final_response = result["response"]
+    print(f"Final response: {final_response}")
+    end = time.time()
+    print(f"Total time taken: {end - start:.2f} seconds")
+    return final_response, reference_final
+
+if __name__ == "__main__":
+    caption_payload = {
+        "image_path": "uploads/09161e93-5171-4dd2-8e27-c0439171c5d1-testsuit.jpg"
+    }
+    user_messages = {
+            "messages": [
+                {"role": "user", "content": "I want a pant that could match with this upper part."},
+            ]
+        }
+    assist_matching(caption_payload, user_messages, "style_matching")
@@ -1,8 +1,9 @@
 from product_matching import product_matching
 from style_matching import style_matching
+from assist_matching import assist_matching
 
 
-def main(caption_payload, user_messages, features):
+def main(caption_payload, user_messages, features, use_assist=False):
     """
     Main function to perform product and style matching based on user input and image captioning.
     
@@ -10,7 +11,13 @@ def main(caption_payload, user_messages, features):
         caption_payload: Dictionary containing image path for captioning
         user_messages: User messages for context
         features: List of features to determine which matching to perform
+        use_assist: Run the whole flow server-side through /assist in one request
     """
+    if use_assist:
+        print(f"Performing {features} via /assist...")
+        assist_matching(caption_payload, user_messages, features)
+        return
+
     if features == "product_matching":
         print("Performing product matching...")
         product_matching(caption_payload, user_messages)
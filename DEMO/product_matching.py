@@ -1,11 +1,12 @@
 import time 
-from util import post_request, HEADERS, filter_reference_documents
+from util import post_request, trace_headers, filter_reference_documents
 
 def product_matching(caption_payload, user_messages):
     """
     Perform product matching using the provided caption payload
     """
     start_time = time.time()
+    headers = trace_headers()
     if caption_payload["image_path"] == "":
         print("No image provided for captioning")
         image_caption = "No image provided"
@@ -14,7 +15,7 @@ def product_matching(caption_payload, user_messages):
         result = post_request(
             "image_captioning",
             caption_payload,
-            headers=HEADERS)
+            headers=headers)
         print(f"Captioning result: {result}")
         image_caption = result["results"]
     
@@ -28,7 +29,7 @@ def product_matching(caption_payload, user_messages):
     result = post_request(
         "finding_documents",
         doc_payload,
-        headers=HEADERS)
+        headers=headers)
     
     reference = result["results"]
     reference_final = filter_reference_documents(reference) 
@@ -37,10 +38,10 @@ def product_matching(caption_payload, user_messages):
     print(f"Generate final response")
     payload = {
         "question": f'''{user_messages}''',
-        "reference":f'''{reference}'''
+        "search_results": reference
     }
     
-    result = post_request("generation", payload, headers=HEADERS, timeout=30)
+    result = post_request("generation", payload, headers=headers, timeout=30)
     final_response = result["response"]
     print(f"Final response: {final_response}")
     end_time = time.time()
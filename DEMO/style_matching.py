@@ -1,4 +1,4 @@
-from util import post_request, HEADERS, filter_reference_documents
+from util import post_request, trace_headers, filter_reference_documents
 import time
 
 
@@ -7,6 +7,7 @@ def style_matching(caption_payload, user_messages):
     Perform style matching using the provided caption 
     """
     start = time.time()
+    headers = trace_headers()
     if caption_payload["image_path"] == "":
         image_caption = "No image provided"
     else:
@@ -14,7 +15,7 @@ def style_matching(caption_payload, user_messages):
         result = post_request(
             "image_captioning",
             caption_payload,
-            headers=HEADERS)
+            headers=headers)
         image_caption = result["results"]
         print(f"Image captioning result: {image_caption}")
     
@@ -26,7 +27,7 @@ def style_matching(caption_payload, user_messages):
     result = post_request(
         "style_complement",
         doc_payload,
-        headers=HEADERS)
+        headers=headers)
     style_complement = result["results"]
     print(f"Style complement result: {style_complement}")
     
@@ -38,7 +39,7 @@ def style_matching(caption_payload, user_messages):
     result = post_request(
         "finding_documents",
         doc_payload,
-        headers=HEADERS, timeout=30)
+        headers=headers, timeout=30)
     reference = result["results"]
     reference_final = filter_reference_documents(reference)
     print(f"Reference documents: {reference_final}")
@@ -46,9 +47,9 @@ def style_matching(caption_payload, user_messages):
     print(f"Generate final response")
     payload = {
         "question": f'''{user_messages}''',
-        "reference": f'''{reference}'''
+        "search_results": reference
     }
-    result = post_request("generation", payload, headers=HEADERS, timeout=30)
+    result = post_request("generation", payload, headers=headers, timeout=30)
     final_response = result["response"]
     print(f"Final response: {final_response}")
     end = time.time()
@@ -1,8 +1,18 @@
+import os
 import requests
 
 BASE_URL = "http://localhost:8001"
 HEADERS = {"Content-Type": "application/json"}
 
+def trace_headers():
+    """
+    Build request headers carrying a fresh W3C traceparent, so every call made
+    with them for one shopper request lands in the same backend trace.
+    """
+    trace_id = os.urandom(16).hex()
+    parent_id = os.urandom(8).hex()
+    return {**HEADERS, "traceparent": f"00-{trace_id}-{parent_id}-01"}
+
 def post_request(endpoint: str, payload: dict, headers: dict, timeout: int = 14):
     url = f"{BASE_URL}/{endpoint}"
     try:
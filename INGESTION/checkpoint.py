@@ -0,0 +1,212 @@
+import os
+import json
+import uuid
+import sqlite3
+import hashlib
+from array import array
+from datetime import datetime, timezone
+
+RUNS_DIR = os.environ.get("INGESTION_RUNS_DIR", "runs")
+
+
+def new_run_id():
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def image_key(image_bytes):
+    # Namespaced so an image can never collide with a text in the shared embeddings table
+    return "image:" + hashlib.sha1(image_bytes).hexdigest()
+
+
+class IngestionRun:
+    """
+    Durable state of one ingestion run, kept in runs/<run_id>.sqlite.
+
+    Holds the checkpoint (how many chunks are committed to the index) and every
+    embedding computed so far, keyed by a hash of the embedded text. Each write is
+    committed immediately, so a crash loses at most the chunk in flight and a restart
+    never pays for the same embedding twice.
+    """
+
+    @staticmethod
+    def path_for(run_id, runs_dir=RUNS_DIR):
+        return os.path.join(runs_dir, f"{run_id}.sqlite")
+
+    @classmethod
+    def exists(cls, run_id, runs_dir=RUNS_DIR):
+        return os.path.exists(cls.path_for(run_id, runs_dir))
+
+    def __init__(self, run_id, runs_dir=RUNS_DIR):
+        os.makedirs(runs_dir, exist_ok=True)
+        self.run_id = run_id
+        self.path = self.path_for(run_id, runs_dir)
+        self.resumed = os.path.exists(self.path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        # Dedup plan: products in catalogue order, their LSH bucket codes, and which product
+        # each variant collapses into. Kept here so planning memory doesn't grow with the catalogue.
+        self.db.execute("CREATE TABLE IF NOT EXISTS dedup_products (number INTEGER PRIMARY KEY, image_url TEXT, key TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS lsh (band INTEGER, code INTEGER, number INTEGER)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS variants "
+            "(image_url TEXT PRIMARY KEY, representative TEXT, number INTEGER, variant TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS variants_by_representative ON variants (representative, number)")
+        self.db.commit()
+
+    def _get(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set(self, **values):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in values.items()]
+            )
+
+    def start(self, source, index_name, chunk_size, dedup=False):
+        """Record the run parameters, or check a resumed run was started with the same ones"""
+        params = {"source": source, "index_name": index_name, "chunk_size": chunk_size, "dedup": dedup}
+        stored = self._get("params")
+        if stored is None:
+            self._set(params=params, chunks_committed=0, products_committed=0)
+        elif stored != params:
+            raise ValueError(f"Run {self.run_id} was started with {stored}, not {params}")
+
+    @property
+    def chunks_committed(self):
+        return self._get("chunks_committed", 0)
+
+    @property
+    def products_committed(self):
+        return self._get("products_committed", 0)
+
+    def commit_chunk(self, product_count):
+        """Checkpoint one more chunk as durably indexed"""
+        self._set(
+            chunks_committed=self.chunks_committed + 1,
+            products_committed=self.products_committed + product_count,
+            updated_at=datetime.now(timezone.utc).isoformat(),
+        )
+
+    def get_embeddings(self, texts):
+        """Cached embeddings for texts (None where not cached yet)"""
+        return self.get_embeddings_by_key([text_key(text) for text in texts])
+
+    def get_embeddings_by_key(self, keys):
+        cached = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self.db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            cached.update((key, array("f", vector).tolist()) for key, vector in rows)
+        return [cached.get(key) for key in keys]
+
+    def put_embeddings(self, texts, embeddings):
+        self.put_embeddings_by_key([text_key(text) for text in texts], embeddings)
+
+    def put_embeddings_by_key(self, keys, embeddings):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", embedding).tobytes()) for key, embedding in zip(keys, embeddings) if embedding]
+            )
+
+    def _select_in(self, query, values, batch=500):
+        """Run query (with one IN ({}) placeholder) over values in batches"""
+        for start in range(0, len(values), batch):
+            chunk = values[start:start + batch]
+            yield from self.db.execute(query.format(",".join("?" * len(chunk))), chunk)
+
+    @property
+    def variants_planned(self):
+        return self._get("variants_planned", False)
+
+    def reset_variant_plan(self):
+        """Drop a plan left half-written by an interrupted run"""
+        with self.db:
+            for table in ("dedup_products", "lsh", "variants"):
+                self.db.execute(f"DELETE FROM {table}")
+        self._set(variants_planned=False)
+
+    def add_dedup_products(self, first_number, image_urls, keys, signatures):
+        """Record the next chunk of products (numbered from first_number) and their LSH codes"""
+        numbers = range(first_number, first_number + len(image_urls))
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO dedup_products (number, image_url, key) VALUES (?, ?, ?)",
+                zip(numbers, image_urls, keys)
+            )
+            self.db.executemany(
+                "INSERT INTO lsh (band, code, number) VALUES (?, ?, ?)",
+                [(band, int(code), number) for number, row in zip(numbers, signatures) for band, code in enumerate(row)]
+            )
+
+    def lsh_candidates(self):
+        """Distinct sets of product numbers sharing an LSH bucket, as sorted lists"""
+        self.db.execute("CREATE INDEX IF NOT EXISTS lsh_bucket ON lsh (band, code, number)")
+        rows = self.db.execute(
+            "SELECT DISTINCT members FROM ("
+            " SELECT group_concat(number) AS members FROM"
+            " (SELECT band, code, number FROM lsh ORDER BY band, code, number)"
+            " GROUP BY band, code HAVING COUNT(*) > 1)"
+        )
+        for (members,) in rows:
+            yield [int(number) for number in members.split(",")]
+
+    def dedup_keys(self, numbers):
+        """Embedding keys of products by number, in the order given"""
+        keys = dict(self._select_in("SELECT number, key FROM dedup_products WHERE number IN ({})", list(numbers)))
+        return [keys[number] for number in numbers]
+
+    def put_variant_links(self, pairs):
+        """Record (variant number, representative number) pairs"""
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO variants (image_url, representative, number) "
+                "SELECT v.image_url, r.image_url, v.number FROM dedup_products v, dedup_products r "
+                "WHERE v.number = ? AND r.number = ?",
+                pairs
+            )
+
+    def put_variant_details(self, details):
+        """Fill in the stored variant entries: (image_url, variant dict) pairs"""
+        with self.db:
+            self.db.executemany(
+                "UPDATE variants SET variant = ? WHERE image_url = ?",
+                [(json.dumps(variant), image_url) for image_url, variant in details]
+            )
+
+    def finish_variant_plan(self):
+        with self.db:
+            self.db.execute("DELETE FROM lsh")
+        self._set(variants_planned=True)
+
+    def variant_count(self):
+        return self.db.execute("SELECT COUNT(*), COUNT(DISTINCT representative) FROM variants").fetchone()
+
+    def collapsed(self, image_urls):
+        """The image_urls that are variants folded into another product"""
+        return {url for (url,) in self._select_in("SELECT image_url FROM variants WHERE image_url IN ({})", list(image_urls))}
+
+    def variants_of(self, image_urls):
+        """representative image_url -> its variants (in catalogue order), for the given representatives"""
+        variants = {}
+        rows = self._select_in(
+            "SELECT representative, variant FROM variants WHERE representative IN ({}) ORDER BY number",
+            list(image_urls)
+        )
+        for representative, variant in rows:
+            variants.setdefault(representative, []).append(json.loads(variant))
+        return variants
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,201 @@
+import re
+import json
+import argparse
+
+import numpy as np
+from tqdm import tqdm
+
+from reader import iter_product_chunks, DEFAULT_CHUNK_SIZE
+from checkpoint import IngestionRun, new_run_id
+from ingestion import embed_chunk
+from util import get_titan_embedding
+
+MATCHES_MARKER = "Matches Well With:"
+# "Tops: ... Outerwear: ..." - a title-case heading of one or two words followed by a colon
+CATEGORY_HEADING = re.compile(r"(?:^|(?<=[\s.]))([A-Z][A-Za-z/&]*(?: [A-Z][A-Za-z/&]*)?):\s")
+# Headings that describe a palette rather than items to buy
+SKIP_CATEGORIES = {"Colors", "Colours"}
+# "x, y, or z" / "a x, a y" - split between items, not inside "a clean, crisp white tee"
+ITEM_SEPARATOR = re.compile(r",?\s+or\s+(?=(?:a|an|the)\s)|,\s*or\s+|,\s+(?=(?:a|an|the)\s)", re.IGNORECASE)
+ARTICLE = re.compile(r"^(?:a|an|the)\s", re.IGNORECASE)
+# Drop the styling rationale: "a black blazer for a more polished look" -> "a black blazer"
+PURPOSE_CLAUSE = re.compile(r"\s+(?:for|to|that|which|when|in order)\s+.*$", re.IGNORECASE)
+# A suggestion must name something a product can be: "sturdy combat boots", not the
+# fragments a list split leaves behind ("a casual, sporty feel" -> "sporty feel")
+ITEM_NOUNS = {
+    # Tops and outerwear
+    "tee", "t-shirt", "shirt", "top", "tank", "camisole", "blouse", "sweater", "sweatshirt", "hoodie",
+    "turtleneck", "bandeau", "bralette", "bikini", "swimsuit", "button-down", "oxford", "poplin",
+    "overshirt", "jacket", "blazer", "coat", "cardigan", "windbreaker", "kimono", "vest", "loungewear",
+    # Dresses and bottoms
+    "dress", "skirt", "jeans", "denim", "trousers", "pants", "chino", "shorts", "joggers", "leggings",
+    # Shoes
+    "sneaker", "trainer", "shoe", "boot", "loafer", "heel", "flat", "sandal", "slide", "mule", "wedge",
+    "espadrille", "high-top", "stiletto", "sock",
+    # Bags and accessories
+    "bag", "tote", "clutch", "backpack", "satchel", "handbag", "briefcase", "wallet", "belt", "hat", "cap",
+    "beanie", "beret", "fedora", "fascinator", "watch", "necklace", "bracelet", "ring", "chain", "jewelry",
+    "jewellery", "earring", "sunglasses", "scarf", "tie", "boutonnire", "clip",
+}
+# Phrases about the effect rather than an item: "simple look", "effortlessly cool outfit"
+STYLE_WORDS = {"look", "feel", "outfit", "vibe", "pairing", "aesthetic", "ensemble"}
+WORD = re.compile(r"[a-z]+(?:-[a-z]+)*")
+
+TOP_K = 3
+MIN_SIMILARITY = 0.35
+BLOCK_SIZE = 1024
+
+
+def description_text(description):
+    return description.split(MATCHES_MARKER)[0].strip()
+
+
+def _singular(word):
+    return [word, word[:-1], word[:-2]] if word.endswith("s") else [word]
+
+
+def is_item(phrase):
+    """Whether a suggestion phrase names a garment or accessory"""
+    words = WORD.findall(phrase.lower())
+    if any(form in STYLE_WORDS for word in words for form in _singular(word)):
+        return False
+    # Hyphenated words count whole ("t-shirt") and by their parts ("crew-neck")
+    candidates = words + [part for word in words if "-" in word for part in word.split("-")]
+    return any(form in ITEM_NOUNS for word in candidates for form in _singular(word))
+
+
+def parse_matches(description):
+    """
+    Pull the suggestions out of a description's "Matches Well With:" section.
+
+    Returns:
+        dict: category -> list of suggestion phrases
+    """
+    if MATCHES_MARKER not in description:
+        return {}
+    section = description.split(MATCHES_MARKER, 1)[1]
+    headings = list(CATEGORY_HEADING.finditer(section))
+    suggestions = {}
+    for heading, following in zip(headings, headings[1:] + [None]):
+        category = heading.group(1)
+        if category in SKIP_CATEGORIES:
+            continue
+        body = section[heading.end():following.start() if following else len(section)].strip().rstrip(".")
+        items = []
+        for part in ITEM_SEPARATOR.split(body):
+            # Article-less lists ("chunky sneakers, combat boots") separate items with bare commas
+            pieces = [part] if ARTICLE.match(part) else part.split(", ")
+            items.extend(PURPOSE_CLAUSE.sub("", piece).strip(" .") for piece in pieces)
+        suggestions[category] = [item for item in items if len(item.split()) >= 2 and is_item(item)]
+    return suggestions
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def resolve(suggestion_vectors, catalogue_vectors, exclude, top_k=TOP_K):
+    """
+    Nearest catalogue products for each suggestion, by blocked matrix products.
+
+    Args:
+        suggestion_vectors: (S, d) normalised
+        catalogue_vectors: (N, d) normalised
+        exclude: length-S array of the catalogue row each suggestion came from (never its own match)
+
+    Returns:
+        tuple: (S, top_k) row indices and (S, top_k) cosine similarities
+    """
+    indices = np.zeros((len(suggestion_vectors), top_k), dtype=np.int64)
+    scores = np.zeros((len(suggestion_vectors), top_k), dtype=np.float32)
+    for start in range(0, len(suggestion_vectors), BLOCK_SIZE):
+        similarity = suggestion_vectors[start:start + BLOCK_SIZE] @ catalogue_vectors.T
+        rows = np.arange(len(similarity))
+        similarity[rows, exclude[start:start + BLOCK_SIZE]] = -np.inf
+        top = np.argpartition(-similarity, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(-similarity[rows[:, None], top], axis=1)
+        indices[start:start + BLOCK_SIZE] = np.take_along_axis(top, order, axis=1)
+        scores[start:start + BLOCK_SIZE] = similarity[rows[:, None], indices[start:start + BLOCK_SIZE]]
+    return indices, scores
+
+
+def build_graph(source, run, chunk_size=DEFAULT_CHUNK_SIZE, top_k=TOP_K):
+    """
+    Build the complementary-item adjacency table for a catalogue.
+
+    Returns:
+        dict: {"products": [{id, name, price, description}],
+               "edges": {row: [[category, target row, score], ...]}}
+    """
+    products, vectors = [], []
+    suggestion_rows, suggestion_categories, suggestion_texts = [], [], []
+    for chunk in tqdm(iter_product_chunks(source, chunk_size), desc="Embedding catalogue", unit="chunk"):
+        # The same description embeddings ingestion uses (and caches in the run)
+        vectors.extend(embed_chunk(chunk, run))
+        for product in chunk:
+            row = len(products)
+            products.append({
+                "id": product.image_url,
+                "name": product.name,
+                "price": product.price,
+                "description": description_text(product.description),
+            })
+            for category, items in parse_matches(product.description).items():
+                for item in items:
+                    suggestion_rows.append(row)
+                    suggestion_categories.append(category)
+                    suggestion_texts.append(item)
+
+    # Suggestions repeat a lot across a catalogue ("classic white sneakers"); embed each once
+    unique_texts = sorted(set(suggestion_texts))
+    cached = run.get_embeddings(unique_texts)
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+    for i in tqdm(missing, desc="Embedding suggestions", unit="item"):
+        cached[i] = get_titan_embedding(unique_texts[i])
+    run.put_embeddings([unique_texts[i] for i in missing], [cached[i] for i in missing])
+    text_vectors = dict(zip(unique_texts, cached))
+    usable = [i for i, text in enumerate(suggestion_texts) if text_vectors[text]]
+    # Nothing to resolve, or no other product a suggestion could resolve to
+    if not usable or len(products) < 2:
+        return {"products": products, "edges": {}}
+
+    indices, scores = resolve(
+        normalize([text_vectors[suggestion_texts[i]] for i in usable]),
+        normalize(vectors),
+        np.asarray([suggestion_rows[i] for i in usable]),
+        top_k=min(top_k, len(products) - 1),
+    )
+
+    edges = {}
+    for n, i in enumerate(usable):
+        targets = edges.setdefault(str(suggestion_rows[i]), [])
+        seen = {target for _, target, _ in targets}
+        for target, score in zip(indices[n], scores[n]):
+            if score >= MIN_SIMILARITY and int(target) not in seen:
+                targets.append([suggestion_categories[i], int(target), round(float(score), 4)])
+                seen.add(int(target))
+    return {"products": products, "edges": edges}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the complementary-item graph from 'Matches Well With' sections")
+    parser.add_argument("source", nargs="?", default="data.csv", help="Catalogue .csv or .parquet")
+    parser.add_argument("--out", default="complement_graph.json", help="Where to write the graph (copy it into BE/)")
+    parser.add_argument("--run-id", help="Reuse the embeddings cached by this ingestion run")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="Catalogue products per suggestion")
+    args = parser.parse_args()
+
+    run = IngestionRun(args.run_id or new_run_id())
+    try:
+        graph = build_graph(args.source, run, top_k=args.top_k)
+    finally:
+        run.close()
+    with open(args.out, "w") as f:
+        json.dump(graph, f, separators=(",", ":"))
+    edge_count = sum(len(targets) for targets in graph["edges"].values())
+    print(f"Wrote {len(graph['products'])} products and {edge_count} complement edges to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
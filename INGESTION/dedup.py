@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+
+# Cosine similarity at or above which two descriptions count as variants of one product
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.97"))
+# Random-hyperplane LSH: a pair becomes a candidate if all ROWS bits agree in any of BANDS bands.
+# With 16 x 20, pairs at cosine 0.97 become candidates with probability ~0.97, at 0.9 ~0.5,
+# at 0.8 ~0.15 and at 0.6 ~0.015, so exact checks stay close to the true duplicates.
+LSH_BANDS = 16
+LSH_ROWS = 20
+VERIFY_BLOCK = 512
+
+
+class UnionFind:
+    """Disjoint sets over 0..size-1, held in one int array (8 bytes per product)"""
+
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = int(parent[item])
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        # The earliest product in the catalogue stays the root, i.e. the representative
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+class VariantGrouper:
+    """
+    Group near-duplicate products by embedding similarity without comparing all pairs.
+
+    signatures() gives each product one LSH bucket code per band; the caller stores them
+    (the ingestion run keeps them in its SQLite file) and later hands the buckets holding
+    more than one product to group(), which verifies candidate pairs with an exact cosine
+    check, loading just those vectors through fetch_vectors. Only the union-find array is
+    held in memory for the whole catalogue.
+    """
+
+    def __init__(self, dimension, threshold=DEDUP_THRESHOLD, seed=0):
+        self.threshold = threshold
+        self.planes = np.random.default_rng(seed).standard_normal((dimension, LSH_BANDS * LSH_ROWS)).astype(np.float32)
+        self.weights = (1 << np.arange(LSH_ROWS, dtype=np.int64))
+
+    def signatures(self, embeddings):
+        """(len(embeddings), LSH_BANDS) bucket codes"""
+        bits = (np.asarray(embeddings, dtype=np.float32) @ self.planes) > 0
+        return bits.reshape(len(embeddings), LSH_BANDS, LSH_ROWS).astype(np.int64) @ self.weights
+
+    def group(self, count, candidates, fetch_vectors):
+        """
+        Args:
+            count: number of products (numbered 0..count-1 in catalogue order)
+            candidates: iterable of product-number lists that share an LSH bucket
+            fetch_vectors: callable taking a list of product numbers and returning their embeddings
+
+        Yields:
+            (variant product number, representative product number), in catalogue order
+        """
+        groups = UnionFind(count)
+        for members in candidates:
+            vectors = np.asarray(fetch_vectors(list(members)), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            for start in range(0, len(members), VERIFY_BLOCK):
+                similarity = vectors[start:start + VERIFY_BLOCK] @ vectors.T
+                for i, j in zip(*np.nonzero(similarity >= self.threshold)):
+                    if start + i < j:
+                        groups.union(members[start + i], members[j])
+
+        for item in range(count):
+            root = groups.find(item)
+            if root != item:
+                yield item, root
@@ -1,7 +1,7 @@
 import json
 import boto3
 from dotenv import load_dotenv
-from opensearchpy import OpenSearch
+from opensearch_client import get_client
 import os
 from tqdm import tqdm
 import pandas as pd
@@ -11,17 +11,8 @@ load_dotenv(override=True)
 AWS_ACCESS_KEY_ID = os.environ["AWS_ACCESS_KEY_ID"]
 AWS_SECRET_ACCESS_KEY = os.environ["AWS_SECRET_ACCESS_KEY"]
 AWS_DEFAULT_REGION = os.environ["AWS_DEFAULT_REGION"]
-AWS_OPENSEARCH_ENDPOINT = os.environ["AWS_OPENSEARCH_ENDPOINT"]
-AWS_OPENSEARCH_USERNAME = os.environ["AWS_OPENSEARCH_USERNAME"]
-AWS_OPENSEARCH_PASSWORD = os.environ["AWS_OPENSEARCH_PASSWORD"]
-
-client = OpenSearch(
-    hosts=[{'host': AWS_OPENSEARCH_ENDPOINT, 'port': 443}],
-    http_auth=(AWS_OPENSEARCH_USERNAME, AWS_OPENSEARCH_PASSWORD),
-    use_ssl=True,
-    verify_certs=True,
-    ssl_show_warn=False,
-)
+
+client = get_client()
 
 
 def creating_index_body(index_name, dimension=1024):
@@ -0,0 +1,94 @@
+import uuid
+import hashlib
+from datetime import datetime, timezone
+
+INDEX_NAME = "product-index"
+EMBEDDING_DIMENSION = 1024
+# amazon.titan-embed-image-v1 (multimodal) output length
+IMAGE_EMBEDDING_DIMENSION = 1024
+# Kept in the mapping's _meta; the backend's search result cache is only valid for one version
+CATALOGUE_VERSION_KEY = "catalogue_version"
+
+
+def new_catalogue_version():
+    # Unique rather than incremented, so concurrent writers never need a read-modify-write
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+
+
+def index_body(dimension=EMBEDDING_DIMENSION, image_dimension=IMAGE_EMBEDDING_DIMENSION):
+    """Settings and mappings for the product index (shared by batch ingestion and the upload Lambda)"""
+    return {
+        "settings": {
+            "index": {
+                "knn": True,
+                "analysis": {
+                    "analyzer": {
+                        "analyzer_shingle": {
+                            "tokenizer": "icu_tokenizer",
+                            "filter": [
+                                "filter_shingle"
+                            ]
+                        }
+                    },
+                    "filter": {
+                        "filter_shingle": {
+                            "type": "shingle",
+                            "max_shingle_size": 3,
+                            "min_shingle_size": 2,
+                            "output_unigrams": "true"
+                        }
+                    }
+                }
+            }
+        },
+        "mappings": {
+            "_meta": {CATALOGUE_VERSION_KEY: new_catalogue_version()},
+            "properties": {
+                "name": {"type": "text"},
+                "description": {"type": "text", "analyzer": "analyzer_shingle"},
+                "price": {"type": "text"},
+                "imageUrl": {"type": "text"},
+                # Near-duplicate products collapsed into this one at ingestion; stored, not searched
+                "variants": {"type": "object", "enabled": False},
+                "vector_en": {
+                    "type": "knn_vector",
+                    "dimension": dimension,
+                    "method": {
+                        "name": "hnsw",
+                        "space_type": "cosinesimil"
+                    }
+                },
+                # Multimodal embedding of the product photo, for search-by-image
+                "vector_image": {
+                    "type": "knn_vector",
+                    "dimension": image_dimension,
+                    "method": {
+                        "name": "hnsw",
+                        "space_type": "cosinesimil"
+                    }
+                }
+            }
+        }
+    }
+
+
+def product_id(image_url):
+    """
+    Document id for a product. Derived from its image, so re-ingesting a product (a
+    batch rerun or a re-delivered upload event) overwrites it instead of adding a copy.
+    """
+    return hashlib.sha1(image_url.encode("utf-8")).hexdigest()
+
+
+def bump_catalogue_version(client, index_name=INDEX_NAME):
+    """
+    Mark the index contents as changed. Refreshes first so that, once the backend sees
+    the new version, searches already return the new documents. The backend polls the
+    version every CATALOGUE_VERSION_CHECK_SECONDS (BE/result_cache.py), so its cached
+    results lag a bump by up to that long.
+
+    This is a refresh plus a cluster-state update: call it once per batch or run, not
+    per document.
+    """
+    client.indices.refresh(index=index_name)
+    client.indices.put_mapping(index=index_name, body={"_meta": {CATALOGUE_VERSION_KEY: new_catalogue_version()}})
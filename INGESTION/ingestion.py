@@ -1,82 +1,267 @@
-from util import get_client, get_titan_embedding
-import pandas as pd
+import os
+import json
+import time
+import random
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from opensearchpy.exceptions import TransportError
+from util import get_client, get_titan_embedding, get_titan_image_embedding
+from index_mapping import INDEX_NAME, EMBEDDING_DIMENSION, index_body, product_id, bump_catalogue_version
+from reader import iter_product_chunks, DEFAULT_CHUNK_SIZE
+from checkpoint import IngestionRun, RUNS_DIR, new_run_id, text_key, image_key
+from dedup import VariantGrouper
+from telemetry import IngestionStats
 from tqdm import tqdm
 
+# Concurrent Titan calls per chunk; keep under the account's embedding RPM
+EMBEDDING_WORKERS = int(os.environ.get("EMBEDDING_WORKERS", "4"))
+BULK_MAX_ATTEMPTS = 5
+# The storefront serves the catalogue photos from here
+DEFAULT_IMAGES_DIR = os.path.join("..", "my-ecommerce-plugin", "public", "assets")
+
 
 
-def creating_index_body(index_name, client,dimension=1024):
-    # Create index with mapping for embeddings
-    create_index_body = {
-        "settings": {
-            "index": {
-                "knn": True,
-                "analysis": {
-                    "analyzer": {
-                        "analyzer_shingle": {
-                            "tokenizer": "icu_tokenizer",
-                            "filter": [
-                                "filter_shingle"
-                            ]
-                        }
-                    },
-                    "filter": {
-                        "filter_shingle": {
-                            "type": "shingle",
-                            "max_shingle_size": 3,
-                            "min_shingle_size": 2,
-                            "output_unigrams": "true"
-                        }
-                    }
-                }
-            }
-        },  
-        "mappings": {
-            "properties": {
-                "name": {"type": "text"},
-                "description": {"type": "text", "analyzer": "analyzer_shingle"},
-                "price": {"type": "text"},
-                "imageUrl": {"type": "text"},
-                "vector_en": {
-                    "type": "knn_vector",
-                    "dimension": dimension,
-                    "method": {
-                        "name": "hnsw",
-                        "space_type": "cosinesimil"
-                    }
-                }
-            }
-        }
-    }
-    
+def creating_index_body(index_name, client, dimension=EMBEDDING_DIMENSION):
     if not client.indices.exists(index=index_name):
         print(f"Index '{index_name}' does not exist. Creating a new one")
     else:
         response = client.indices.delete(index=index_name)
         print(f"Index '{index_name}' deleted successfully.")
-    client.indices.create(index=index_name, body=create_index_body)
-
-def ingestion_data_opensearch(index_name, dataframe, client):
-    # Index the documents with semantic embeddings and raw text
-    for i in tqdm(range(len(dataframe)), desc="Ingesting products", unit="item"):
-        # Generate embeddings
-        Product_Name = dataframe.iloc[i]['name']
-        Product_Description = dataframe.iloc[i]['description']
-        Product_Price = dataframe.iloc[i]['price']
-        Image = dataframe.iloc[i]['imageUrl']
-        embedding = get_titan_embedding(Product_Description)
-
-        # Index document with both raw text and embeddings
-        res = client.index(index=index_name, id=i, body={
-            "name": Product_Name,
-            "description": Product_Description,
-            "price": Product_Price,
-            "imageUrl": Image,
-            "vector_en": embedding 
-        })
+    client.indices.create(index=index_name, body=index_body(dimension))
 
-if __name__ == "__main__":
-    df = pd.read_csv("data.csv")
-    index_name = "product-index"
+def embed_chunk(products, run=None, stats=None):
+    """
+    Titan embeddings for a chunk, a few calls in flight at once. Embeddings already
+    stored in the run are reused; new ones are stored before the chunk is indexed.
+    """
+    texts = [product.description for product in products]
+    embeddings = run.get_embeddings(texts) if run else [None] * len(texts)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if stats:
+        stats.record_cached_embeddings(len(texts) - len(missing))
+    with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as pool:
+        for i, embedding in zip(missing, pool.map(lambda text: get_titan_embedding(text, stats), [texts[i] for i in missing])):
+            embeddings[i] = embedding
+    if run:
+        run.put_embeddings([texts[i] for i in missing], [embeddings[i] for i in missing])
+
+    failed = [products[i].image_url for i, embedding in enumerate(embeddings) if embedding is None]
+    if failed:
+        # Stop before indexing documents without vectors; resuming retries only these
+        raise RuntimeError(f"Embedding failed for {len(failed)} products: {failed[:5]}")
+    return embeddings
+
+def read_image(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+def embed_images_chunk(products, images_dir, run=None, stats=None):
+    """
+    Multimodal embeddings of the chunk's product photos, read from images_dir by imageUrl.
+    Missing photos and failed calls give None: the product is still indexed, just not
+    findable by image.
+    """
+    images = [read_image(os.path.join(images_dir, os.path.basename(product.image_url))) for product in products]
+    keys = [image_key(image) if image else None for image in images]
+    embeddings = run.get_embeddings_by_key(keys) if run else [None] * len(keys)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None and images[i]]
+    with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as pool:
+        for i, embedding in zip(missing, pool.map(lambda image: get_titan_image_embedding(image, stats), [images[i] for i in missing])):
+            embeddings[i] = embedding
+    if run:
+        run.put_embeddings_by_key([keys[i] for i in missing], [embeddings[i] for i in missing])
+    return embeddings
+
+def index_chunk(index_name, products, embeddings, client, stats=None, variants=None, image_embeddings=None):
+    """
+    Index a chunk in one bulk request instead of one request per product.
+    Documents the cluster rejects with 429 are resent with backoff; any other error fails the chunk.
+    """
+    variants = variants or {}
+    image_embeddings = image_embeddings or [None] * len(products)
+    pending = [(product_id(product.image_url),
+                product.to_document(embedding, variants.get(product.image_url), image_embedding))
+               for product, embedding, image_embedding in zip(products, embeddings, image_embeddings)]
+    for attempt in range(BULK_MAX_ATTEMPTS):
+        payload = "".join(
+            json.dumps({"index": {"_index": index_name, "_id": doc_id}}) + "\n" + json.dumps(doc) + "\n"
+            for doc_id, doc in pending
+        )
+        start = time.perf_counter()
+        try:
+            response = client.bulk(body=payload)
+        except TransportError as e:
+            if e.status_code != 429 or attempt + 1 == BULK_MAX_ATTEMPTS:
+                raise
+            response = None
+        finally:
+            if stats:
+                # json.dumps escapes non-ASCII, so characters == bytes on the wire
+                stats.record_bulk(time.perf_counter() - start, len(pending), len(payload))
+
+        if response is None:
+            rejected = pending
+        else:
+            rejected, errors = [], []
+            for doc, item in zip(pending, response["items"]):
+                result = item["index"]
+                if result.get("status") == 429:
+                    rejected.append(doc)
+                elif "error" in result:
+                    errors.append(result["error"])
+            for error in errors:
+                print(f"Failed to index: {error}")
+            if errors:
+                raise RuntimeError(f"{len(errors)} of {len(pending)} documents failed to index")
+            if stats:
+                stats.record_indexed(len(pending) - len(rejected))
+
+        if not rejected:
+            return
+        pending = rejected
+        if stats:
+            stats.record_bulk_retry(throttled=True)
+        time.sleep(random.uniform(0, min(30.0, 2 ** attempt)))
+    raise RuntimeError(f"{len(pending)} documents still rejected after {BULK_MAX_ATTEMPTS} bulk attempts")
+
+def plan_variants(read_chunks, run, stats=None):
+    """
+    Dedup pass: embed the whole catalogue (cached in the run, so indexing reuses it)
+    and group near-duplicate products. The plan is written to the run's SQLite file
+    rather than held in memory, and a resumed run reuses a finished plan.
+
+    Args:
+        read_chunks: callable returning a fresh iterator of Product chunks; the source is read twice
+        run: IngestionRun holding the embeddings and the plan
+        stats: optional IngestionStats
+    """
+    if run.variants_planned:
+        return
+    run.reset_variant_plan()
+    stats = stats or IngestionStats()
+    grouper = None
+    count = 0
+    for products in tqdm(read_chunks(), desc="Embedding for dedup", unit="chunk"):
+        with stats.stage("embedding"):
+            embeddings = embed_chunk(products, run, stats)
+        grouper = grouper or VariantGrouper(len(embeddings[0]))
+        run.add_dedup_products(
+            count,
+            [product.image_url for product in products],
+            [text_key(product.description) for product in products],
+            grouper.signatures(embeddings),
+        )
+        count += len(products)
+
+    if grouper is not None:
+        pairs = grouper.group(count, run.lsh_candidates(),
+                              lambda numbers: run.get_embeddings_by_key(run.dedup_keys(numbers)))
+        for batch in iter(lambda: list(itertools.islice(pairs, 1000)), []):
+            run.put_variant_links(batch)
+        for products in read_chunks():
+            collapsed = run.collapsed(product.image_url for product in products)
+            run.put_variant_details([(product.image_url, product.to_variant())
+                                     for product in products if product.image_url in collapsed])
+    run.finish_variant_plan()
+    variant_count, representative_count = run.variant_count()
+    print(f"Dedup: {variant_count} products collapsed into {representative_count} representatives")
+
+def ingestion_data_opensearch(index_name, chunks, client, run=None, stats=None, dedup=False, images_dir=None):
+    """
+    Embed and index a catalogue chunk by chunk.
+
+    Args:
+        index_name: target index
+        chunks: iterable of lists of Product, e.g. from reader.iter_product_chunks
+        client: OpenSearch client
+        run: optional IngestionRun; chunks it has already committed are skipped and
+             every newly indexed chunk is checkpointed
+        stats: optional IngestionStats to record throughput into
+        dedup: fold variants planned by plan_variants() (in run) into their
+               representative's document instead of indexing them themselves
+        images_dir: optional directory of product photos to add image embeddings from
+    """
+    stats = stats or IngestionStats()
+    skip = run.chunks_committed if run else 0
+    chunks = iter(chunks)
+    indexed = False
+    try:
+        with tqdm(desc="Ingesting products", unit="item", initial=run.products_committed if run else 0) as progress:
+            for number in itertools.count():
+                with stats.stage("read"):
+                    products = next(chunks, None)
+                if products is None:
+                    break
+                if number < skip:
+                    continue
+                read_count = len(products)
+                variants = {}
+                if dedup:
+                    collapsed = run.collapsed([product.image_url for product in products])
+                    products = [product for product in products if product.image_url not in collapsed]
+                    variants = run.variants_of([product.image_url for product in products])
+                if products:
+                    with stats.stage("embedding"):
+                        embeddings = embed_chunk(products, run, stats)
+                        image_embeddings = embed_images_chunk(products, images_dir, run, stats) if images_dir else None
+                    with stats.stage("indexing"):
+                        index_chunk(index_name, products, embeddings, client, stats, variants, image_embeddings)
+                    indexed = True
+                if run:
+                    with stats.stage("checkpoint"):
+                        run.commit_chunk(read_count)
+                progress.update(read_count)
+    finally:
+        # Once per run, not per chunk: each bump is a refresh plus a cluster-state update,
+        # and invalidates all of the backend's cached search results. Also on a failed run,
+        # so the chunks that did make it in show up in cached searches.
+        if indexed:
+            bump_catalogue_version(client, index_name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed a product catalogue and index it into OpenSearch")
+    parser.add_argument("source", nargs="?", default="data.csv", help="Catalogue .csv or .parquet")
+    parser.add_argument("--run-id", help="Resume this run from its last checkpoint")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--report-json", help="Also write the throughput report to this JSON file")
+    parser.add_argument("--no-dedup", action="store_true", help="Index near-duplicate products separately")
+    parser.add_argument("--images-dir", default=DEFAULT_IMAGES_DIR,
+                        help="Product photos named by imageUrl, embedded for search-by-image ('' to skip)")
+    args = parser.parse_args()
+    if args.run_id and not IngestionRun.exists(args.run_id):
+        # Starting fresh here would recreate (i.e. wipe) the index the run was meant to resume into
+        parser.error(f"No run {args.run_id!r} to resume in {RUNS_DIR}/")
+
+    index_name = INDEX_NAME
     client = get_client()
-    creating_index_body(index_name, client)
-    ingestion_data_opensearch(index_name, df, client)
\ No newline at end of file
+    run = IngestionRun(args.run_id or new_run_id())
+    run.start(os.path.abspath(args.source), index_name, args.chunk_size, dedup=not args.no_dedup)
+    if run.resumed:
+        # Never recreate the index on resume: that would wipe what the run already indexed
+        print(f"Resuming run {run.run_id} after {run.products_committed} products")
+    else:
+        print(f"Starting run {run.run_id} (resume with --run-id {run.run_id})")
+        creating_index_body(index_name, client)
+    stats = IngestionStats()
+    read_chunks = lambda: iter_product_chunks(args.source, args.chunk_size)
+    try:
+        # A finished plan is kept in the run; an interrupted one is redone from the cached embeddings
+        if not args.no_dedup:
+            plan_variants(read_chunks, run, stats)
+        images_dir = args.images_dir if args.images_dir and os.path.isdir(args.images_dir) else None
+        if args.images_dir and not images_dir:
+            print(f"No images directory at {args.images_dir}; indexing without image embeddings")
+        ingestion_data_opensearch(index_name, read_chunks(), client, run, stats, not args.no_dedup, images_dir)
+    finally:
+        run.close()
+        # Also on failure: the numbers show whether Titan quota, the cluster or parsing was the bottleneck
+        stats.print_report()
+        if args.report_json:
+            stats.write_json(args.report_json)
+
+if __name__ == "__main__":
+    main()
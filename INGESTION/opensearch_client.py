@@ -0,0 +1,31 @@
+import os
+from functools import lru_cache
+
+# Connections kept open per process. urllib3's default of 10 makes the 11th concurrent
+# search or bulk request wait for a free connection or open (and TLS-handshake) a new one.
+OPENSEARCH_POOL_SIZE = int(os.environ.get("OPENSEARCH_POOL_SIZE", "32"))
+OPENSEARCH_TIMEOUT = float(os.environ.get("OPENSEARCH_TIMEOUT", "30"))
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    """
+    The process-wide OpenSearch client (shared by batch ingestion, the offline jobs and
+    the upload Lambda, which packages this file alongside itself).
+
+    Connections are pooled and kept alive between requests, and request and response
+    bodies are gzip-compressed: bulk bodies and kNN hits are mostly float arrays and
+    compress well.
+    """
+    from opensearchpy import OpenSearch
+
+    return OpenSearch(
+        hosts=[{'host': os.environ["AWS_OPENSEARCH_ENDPOINT"], 'port': 443}],
+        http_auth=(os.environ["AWS_OPENSEARCH_USERNAME"], os.environ["AWS_OPENSEARCH_PASSWORD"]),
+        use_ssl=True,
+        verify_certs=True,
+        ssl_show_warn=False,
+        http_compress=True,
+        pool_maxsize=OPENSEARCH_POOL_SIZE,
+        timeout=OPENSEARCH_TIMEOUT,
+    )
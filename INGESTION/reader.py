@@ -0,0 +1,75 @@
+import os
+from dataclasses import dataclass
+from typing import Iterator, List
+
+import pandas as pd
+
+PRODUCT_COLUMNS = ["name", "description", "price", "imageUrl"]
+DEFAULT_CHUNK_SIZE = 256
+
+
+@dataclass(frozen=True)
+class Product:
+    name: str
+    description: str
+    price: str
+    image_url: str
+
+    def to_document(self, embedding, variants=None, image_embedding=None) -> dict:
+        """Index document in the product-index mapping"""
+        document = {
+            "name": self.name,
+            "description": self.description,
+            "price": self.price,
+            "imageUrl": self.image_url,
+            "vector_en": embedding,
+        }
+        if variants:
+            document["variants"] = variants
+        if image_embedding:
+            document["vector_image"] = image_embedding
+        return document
+
+    def to_variant(self) -> dict:
+        """Compact entry in a representative's variants list"""
+        return {"name": self.name, "price": self.price, "imageUrl": self.image_url}
+
+
+def _iter_csv(path, chunk_size) -> Iterator[List[Product]]:
+    # Every column is text in the index; reading as str avoids per-chunk dtype inference
+    for frame in pd.read_csv(path, usecols=PRODUCT_COLUMNS, dtype=str, keep_default_na=False, chunksize=chunk_size):
+        yield [Product(*row) for row in frame[PRODUCT_COLUMNS].itertuples(index=False, name=None)]
+
+
+def _iter_parquet(path, chunk_size) -> Iterator[List[Product]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet needs pyarrow: pip install pyarrow")
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=PRODUCT_COLUMNS):
+        columns = [batch.column(name).to_pylist() for name in PRODUCT_COLUMNS]
+        yield [Product(*("" if value is None else str(value) for value in row)) for row in zip(*columns)]
+
+
+def iter_product_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE) -> Iterator[List[Product]]:
+    """
+    Stream a product catalogue in fixed-size chunks.
+
+    Only one chunk is held in memory at a time, so memory is bounded by chunk_size
+    rather than by the size of the catalogue.
+
+    Args:
+        path: .csv or .parquet file with name, description, price and imageUrl columns
+        chunk_size: products per chunk
+
+    Returns:
+        Iterator of lists of Product
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return _iter_csv(path, chunk_size)
+    if extension in (".parquet", ".pq"):
+        return _iter_parquet(path, chunk_size)
+    raise ValueError(f"Unsupported catalogue format '{extension}' (expected .csv or .parquet)")
+
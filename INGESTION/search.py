@@ -5,6 +5,8 @@ def fuzzy_search(index_name, search_term,client):
     print("\nFuzzy search\n")
     # Fuzzy search
     fuzzy_query = {
+        # Only the fields printed below; the embeddings stay on the cluster
+        "_source": ["name", "description", "price"],
         "query": {
             "fuzzy": {
                 "description": {  # Changed from en_character to Product Description
@@ -40,6 +42,8 @@ def semantic_search(search_term, client, top_k=3, index_name="product-index"):
     # Semantic search in OpenSearch
     vector_query = {
         "size": top_k,
+        # Leave the embeddings on the cluster: only the fields read below come back
+        "_source": ["imageUrl", "name", "description", "price"],
         "query": {
             "knn": {
                 "vector_en": {
@@ -0,0 +1,184 @@
+import os
+import zlib
+import argparse
+
+import numpy as np
+from opensearchpy.helpers import scan
+from tqdm import tqdm
+
+from util import get_client
+from index_mapping import INDEX_NAME, EMBEDDING_DIMENSION
+
+TOP_N = 20
+ROW_BLOCK = 1024
+COLUMN_BLOCK = 65536
+# Above this share of changed products a full rebuild is about as cheap as patching
+FULL_REBUILD_FRACTION = 0.2
+
+
+def load_catalogue_vectors(client, index_name=INDEX_NAME):
+    """
+    Scroll the stored embeddings out of the index.
+
+    Returns:
+        tuple: (ids, names, prices, normalised (N, d) float32 vectors, per-vector checksums)
+    """
+    ids, names, prices, vectors = [], [], [], []
+    hits = scan(client, index=index_name, query={"_source": ["imageUrl", "name", "price", "vector_en"]}, size=500)
+    for hit in tqdm(hits, desc="Reading embeddings", unit="doc"):
+        source = hit["_source"]
+        if not source.get("vector_en"):
+            continue
+        ids.append(source["imageUrl"])
+        names.append(source.get("name", ""))
+        prices.append(source.get("price", ""))
+        vectors.append(source["vector_en"])
+    # An empty index still gives an (0, d) matrix, so everything downstream sees zero rows
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1 if vectors else EMBEDDING_DIMENSION)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    checksums = np.asarray([zlib.crc32(vector.tobytes()) for vector in vectors], dtype=np.uint32)
+    return np.asarray(ids), np.asarray(names), np.asarray(prices), vectors, checksums
+
+
+def _merge_top(indices, scores, new_indices, new_scores, top_n):
+    """Keep the top_n of two (rows, *) candidate sets, best first"""
+    indices = np.concatenate([indices, new_indices], axis=1)
+    scores = np.concatenate([scores, new_scores], axis=1)
+    if scores.shape[1] > top_n:
+        keep = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        indices = np.take_along_axis(indices, keep, axis=1)
+        scores = np.take_along_axis(scores, keep, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def top_neighbors(vectors, rows, columns, top_n=TOP_N):
+    """
+    Top-n most similar columns for each of rows, by blocked matrix products.
+
+    Memory stays at ROW_BLOCK x COLUMN_BLOCK scores however large the catalogue is.
+
+    Args:
+        vectors: (N, d) normalised embeddings
+        rows: indices to compute neighbours for
+        columns: indices that may appear as neighbours
+
+    Returns:
+        tuple: (len(rows), top_n) neighbour indices (-1 padded) and cosine scores (-inf padded)
+    """
+    rows, columns = np.asarray(rows), np.asarray(columns)
+    indices = np.full((len(rows), top_n), -1, dtype=np.int64)
+    scores = np.full((len(rows), top_n), -np.inf, dtype=np.float32)
+    for row_start in range(0, len(rows), ROW_BLOCK):
+        block_rows = rows[row_start:row_start + ROW_BLOCK]
+        block_indices = indices[row_start:row_start + ROW_BLOCK]
+        block_scores = scores[row_start:row_start + ROW_BLOCK]
+        for column_start in range(0, len(columns), COLUMN_BLOCK):
+            block_columns = columns[column_start:column_start + COLUMN_BLOCK]
+            similarity = vectors[block_rows] @ vectors[block_columns].T
+            # A product is never its own neighbour
+            similarity[block_rows[:, None] == block_columns[None, :]] = -np.inf
+            candidates = np.broadcast_to(block_columns, similarity.shape)
+            block_indices, block_scores = _merge_top(block_indices, block_scores, candidates, similarity, top_n)
+        indices[row_start:row_start + ROW_BLOCK] = block_indices
+        scores[row_start:row_start + ROW_BLOCK] = block_scores
+    return indices, scores
+
+
+def build_table(vectors, top_n=TOP_N):
+    everything = np.arange(len(vectors))
+    return top_neighbors(vectors, everything, everything, top_n)
+
+
+def refresh_table(old, ids, vectors, checksums, top_n=TOP_N):
+    """
+    Patch a previous table for the products that changed since it was built.
+
+    Rows of changed products, and rows whose neighbour lists point at a changed or removed
+    product, are recomputed in full. Every other row only needs comparing against the
+    changed products: (unchanged x changed) instead of (N x N).
+
+    Returns:
+        tuple: (neighbour indices, scores, number of recomputed rows), or None when a
+               full rebuild is the better deal
+    """
+    old_row = {product: row for row, product in enumerate(old["ids"])}
+    previous = np.asarray([old_row.get(product, -1) for product in ids])
+    known = previous >= 0
+    unchanged = known.copy()
+    unchanged[known] = old["checksums"][previous[known]] == checksums[known]
+    changed = np.flatnonzero(~unchanged)
+    if len(changed) > FULL_REBUILD_FRACTION * len(ids) or old["neighbors"].shape[1] != top_n:
+        return None
+
+    # Old neighbour lists in the new numbering; stale entries (changed or removed products) become -1
+    still_valid = np.full(len(old["ids"]), -1, dtype=np.int64)
+    still_valid[previous[unchanged]] = np.flatnonzero(unchanged)
+    old_neighbors = old["neighbors"][previous[unchanged]]
+    remapped = np.where(old_neighbors >= 0, still_valid[np.maximum(old_neighbors, 0)], -1)
+    stale = (remapped == -1) & (old_neighbors >= 0)
+
+    indices = np.full((len(ids), top_n), -1, dtype=np.int64)
+    scores = np.full((len(ids), top_n), -np.inf, dtype=np.float32)
+    indices[unchanged] = remapped
+    scores[unchanged] = np.where(remapped >= 0, old["scores"][previous[unchanged]].astype(np.float32), -np.inf)
+
+    recompute = np.union1d(changed, np.flatnonzero(unchanged)[stale.any(axis=1)])
+    everything = np.arange(len(ids))
+    if len(recompute):
+        indices[recompute], scores[recompute] = top_neighbors(vectors, recompute, everything, top_n)
+
+    patch = np.setdiff1d(everything, recompute)
+    if len(patch) and len(changed):
+        new_indices, new_scores = top_neighbors(vectors, patch, changed, top_n)
+        indices[patch], scores[patch] = _merge_top(indices[patch], scores[patch], new_indices, new_scores, top_n)
+    return indices, scores, len(recompute)
+
+
+def load_table(path):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def save_table(path, ids, names, prices, checksums, indices, scores):
+    """Write to a temp file and rename, so the backend never loads a half-written table"""
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(
+            f,
+            ids=ids,
+            names=names,
+            prices=prices,
+            checksums=checksums,
+            neighbors=np.where(np.isfinite(scores), indices, -1).astype(np.int32),
+            scores=np.where(np.isfinite(scores), scores, 0).astype(np.float16),
+        )
+    os.replace(path + ".tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the top-N similar products for every product")
+    parser.add_argument("--out", default="similar_items.npz", help="Table to write (and refresh); copy it into BE/")
+    parser.add_argument("--top-n", type=int, default=TOP_N)
+    parser.add_argument("--full", action="store_true", help="Rebuild from scratch instead of refreshing")
+    args = parser.parse_args()
+
+    ids, names, prices, vectors, checksums = load_catalogue_vectors(get_client())
+    if not len(ids):
+        print("No embedded products in the index; nothing to write")
+        return
+    old = None if args.full else load_table(args.out)
+    refreshed = refresh_table(old, ids, vectors, checksums, args.top_n) if old is not None else None
+    if refreshed is None:
+        print(f"Computing neighbours for all {len(ids)} products")
+        indices, scores = build_table(vectors, args.top_n)
+    else:
+        indices, scores, recomputed = refreshed
+        print(f"Refreshed {args.out}: {recomputed} of {len(ids)} rows recomputed")
+    save_table(args.out, ids, names, prices, checksums, indices, scores)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+STAGES = ["read", "embedding", "indexing", "checkpoint"]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list (0 for an empty list)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class IngestionStats:
+    """
+    Throughput counters for one ingestion run.
+
+    Embedding calls report from worker threads, so every update takes the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.perf_counter()
+        self.docs_indexed = 0
+        self.embedding_latencies = []
+        self.embeddings_cached = 0
+        self.bulk_latencies = []
+        self.bulk_docs = []
+        self.bulk_bytes = []
+        self.bytes_sent = 0
+        self.throttles = {"bedrock": 0, "opensearch": 0}
+        self.retries = {"bedrock": 0, "opensearch": 0}
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+
+    @contextmanager
+    def stage(self, name):
+        """Add the wall time of the enclosed block to a stage of the time split"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stage_seconds[name] += time.perf_counter() - start
+
+    def record_embedding(self, seconds, request_bytes, retries=0):
+        """One embedding call, including its retries"""
+        with self._lock:
+            self.embedding_latencies.append(seconds)
+            self.bytes_sent += request_bytes * (retries + 1)
+            self.retries["bedrock"] += retries
+
+    def record_embedding_throttle(self):
+        with self._lock:
+            self.throttles["bedrock"] += 1
+
+    def record_cached_embeddings(self, count):
+        with self._lock:
+            self.embeddings_cached += count
+
+    def record_bulk(self, seconds, docs, request_bytes):
+        with self._lock:
+            self.bulk_latencies.append(seconds)
+            self.bulk_docs.append(docs)
+            self.bulk_bytes.append(request_bytes)
+            self.bytes_sent += request_bytes
+
+    def record_bulk_retry(self, throttled):
+        with self._lock:
+            self.retries["opensearch"] += 1
+            self.throttles["opensearch"] += int(throttled)
+
+    def record_indexed(self, docs):
+        with self._lock:
+            self.docs_indexed += docs
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started_at
+        with self._lock:
+            return {
+                "elapsed_seconds": round(elapsed, 3),
+                "docs_indexed": self.docs_indexed,
+                "docs_per_second": round(self.docs_indexed / elapsed, 2) if elapsed else 0.0,
+                "embedding": {
+                    "calls": len(self.embedding_latencies),
+                    "cached": self.embeddings_cached,
+                    **{f"p{pct}_ms": round(percentile(self.embedding_latencies, pct) * 1000, 1) for pct in (50, 90, 99)},
+                },
+                "bulk": {
+                    "requests": len(self.bulk_latencies),
+                    **{f"p{pct}_ms": round(percentile(self.bulk_latencies, pct) * 1000, 1) for pct in (50, 90, 99)},
+                    "avg_docs": round(sum(self.bulk_docs) / len(self.bulk_docs), 1) if self.bulk_docs else 0,
+                    "avg_bytes": int(sum(self.bulk_bytes) / len(self.bulk_bytes)) if self.bulk_bytes else 0,
+                },
+                "throttles": dict(self.throttles),
+                "retries": dict(self.retries),
+                "bytes_sent": self.bytes_sent,
+                "stage_seconds": {name: round(seconds, 3) for name, seconds in self.stage_seconds.items()},
+            }
+
+    def print_report(self):
+        report = self.report()
+        embedding, bulk = report["embedding"], report["bulk"]
+        split_total = sum(report["stage_seconds"].values()) or 1.0
+        print(f"\nIndexed {report['docs_indexed']} docs in {report['elapsed_seconds']:.1f}s "
+              f"({report['docs_per_second']:.1f} docs/s), {report['bytes_sent'] / 1e6:.1f} MB sent")
+        print(f"Embedding: {embedding['calls']} calls ({embedding['cached']} cached), "
+              f"p50 {embedding['p50_ms']} ms, p90 {embedding['p90_ms']} ms, p99 {embedding['p99_ms']} ms")
+        print(f"Bulk:      {bulk['requests']} requests, p50 {bulk['p50_ms']} ms, p90 {bulk['p90_ms']} ms, "
+              f"p99 {bulk['p99_ms']} ms, avg {bulk['avg_docs']} docs / {bulk['avg_bytes'] / 1e3:.0f} KB")
+        print(f"Throttles: bedrock {report['throttles']['bedrock']}, opensearch {report['throttles']['opensearch']}; "
+              f"retries: bedrock {report['retries']['bedrock']}, opensearch {report['retries']['opensearch']}")
+        print("Time split: " + ", ".join(
+            f"{name} {seconds:.1f}s ({seconds / split_total:.0%})" for name, seconds in report["stage_seconds"].items()
+        ))
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,41 @@
+"""
+parse_matches against real catalogue text (data.csv).
+
+Run from INGESTION/: python -m pytest -q test_complements.py
+"""
+import os
+import csv
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from complements import parse_matches, is_item  # noqa: E402
+
+CATALOGUE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data.csv")
+
+
+def catalogue_description(name):
+    with open(CATALOGUE, newline="", encoding="utf-8") as f:
+        return next(row["description"] for row in csv.DictReader(f) if row["name"] == name)
+
+
+def test_parse_matches_keeps_only_items():
+    matches = parse_matches(catalogue_description("Pink Corduroy Jacket"))
+    assert matches["Bottoms"] == [
+        "Pleated midi skirts in neutral tones",
+        "tailored plaid trousers",
+        "light-wash distressed denim jeans",
+    ]
+    assert matches["Shoes"] == ["Chunky loafers", "sturdy combat boots", "retro high-top canvas sneakers"]
+    assert matches["Accessories"] == ["A brown leather satchel bag", "a vintage-inspired beret"]
+    suggestions = [item for items in matches.values() for item in items]
+    assert "effortlessly cool outfit" not in suggestions
+    assert "sporty feel" not in suggestions
+
+
+def test_is_item_rejects_styling_phrases():
+    for phrase in ["simple look", "sporty feel", "effortlessly cool outfit", "casual pairing", "barefoot in the sand"]:
+        assert not is_item(phrase), phrase
+    for phrase in ["a bohemian-style shoulder bag", "A plain white t-shirt (as shown)", "White wide-leg trousers"]:
+        assert is_item(phrase), phrase
@@ -1,49 +1,78 @@
 import boto3
 from dotenv import load_dotenv
-from opensearchpy import OpenSearch
 import os 
 import json
+import base64
+import time
+import random
+import threading
+from functools import lru_cache
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from index_mapping import IMAGE_EMBEDDING_DIMENSION
+# Re-exported: callers have always taken the OpenSearch client from here
+from opensearch_client import get_client
 
 load_dotenv(override=True)
 AWS_ACCESS_KEY_ID = os.environ["AWS_ACCESS_KEY_ID"]
 AWS_SECRET_ACCESS_KEY = os.environ["AWS_SECRET_ACCESS_KEY"]
 AWS_DEFAULT_REGION = os.environ["AWS_DEFAULT_REGION"]
-AWS_OPENSEARCH_ENDPOINT = os.environ["AWS_OPENSEARCH_ENDPOINT"]
-AWS_OPENSEARCH_USERNAME = os.environ["AWS_OPENSEARCH_USERNAME"]
-AWS_OPENSEARCH_PASSWORD = os.environ["AWS_OPENSEARCH_PASSWORD"]
 
+# Retried here rather than inside botocore so every throttle and retry can be counted
+EMBEDDING_MAX_ATTEMPTS = 5
+RETRYABLE_CODES = {"ThrottlingException", "ServiceUnavailableException", "ModelNotReadyException"}
+IMAGE_EMBEDDING_MODEL_ID = "amazon.titan-embed-image-v1"
 
+_client_lock = threading.Lock()
 
-def get_client():
+@lru_cache(maxsize=None)
+def _bedrock_client():
+    return boto3.client(
+        'bedrock-runtime', 
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_DEFAULT_REGION,
+        config=Config(retries={"max_attempts": 1, "mode": "standard"})
+    )
+
+def get_bedrock_client():
     """
-    Function use to create a client for OpenSearch
+    Shared Bedrock runtime client. Using a client from many threads is safe, building one
+    on the default session is not, and the first calls come from the embedding workers.
     """
-    client = OpenSearch(
-    hosts=[{'host': AWS_OPENSEARCH_ENDPOINT, 'port': 443}],
-    http_auth=(AWS_OPENSEARCH_USERNAME, AWS_OPENSEARCH_PASSWORD),
-    use_ssl=True,
-    verify_certs=True,
-    ssl_show_warn=False,
-    )
-    return client
+    with _client_lock:
+        return _bedrock_client()
+
+def invoke_with_retry(body: str, stats=None, model_id="amazon.titan-embed-text-v2:0"):
+    """invoke_model with full-jitter backoff on throttling, reporting latency and retries to stats"""
+    start = time.perf_counter()
+    retries = 0
+    try:
+        while True:
+            try:
+                return get_bedrock_client().invoke_model(
+                    modelId=model_id,
+                    body=body,
+                    contentType='application/json'
+                )
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code not in RETRYABLE_CODES or retries + 1 >= EMBEDDING_MAX_ATTEMPTS:
+                    raise
+                if stats and code == "ThrottlingException":
+                    stats.record_embedding_throttle()
+                retries += 1
+                time.sleep(random.uniform(0, min(20.0, 0.5 * 2 ** retries)))
+    finally:
+        if stats:
+            stats.record_embedding(time.perf_counter() - start, len(body), retries)
 
-def get_titan_embedding(text: str) -> list:
+def get_titan_embedding(text: str, stats=None) -> list:
     """Get embeddings with proper error handling"""
     try:
-        bedrock = boto3.client(
-            'bedrock-runtime', 
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_DEFAULT_REGION
-        )
-        
         payload = {"inputText": text}
         
-        response = bedrock.invoke_model(
-            modelId="amazon.titan-embed-text-v2:0",
-            body=json.dumps(payload),
-            contentType='application/json'
-        )
+        response = invoke_with_retry(json.dumps(payload), stats)
         
         result = json.loads(response['body'].read())
         
@@ -64,3 +93,15 @@ def get_titan_embedding(text: str) -> list:
         print(f"Error getting embedding: {e}")
         return None
 
+def get_titan_image_embedding(image_bytes: bytes, stats=None) -> list:
+    """Multimodal (image) embedding of a product photo; None on failure"""
+    try:
+        payload = {
+            "inputImage": base64.b64encode(image_bytes).decode("utf-8"),
+            "embeddingConfig": {"outputEmbeddingLength": IMAGE_EMBEDDING_DIMENSION}
+        }
+        response = invoke_with_retry(json.dumps(payload), stats, model_id=IMAGE_EMBEDDING_MODEL_ID)
+        return json.loads(response['body'].read()).get('embedding') or None
+    except Exception as e:
+        print(f"Error getting image embedding: {e}")
+        return None
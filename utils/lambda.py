@@ -1,13 +1,43 @@
+import os
 import boto3
 import json
-import csv
 import io
+import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
 
-s3 = boto3.client('s3')
-bedrock = boto3.client('bedrock-runtime')
+from functools import lru_cache
+from botocore.exceptions import ClientError
+
+# Packaged alongside this file from INGESTION/index_mapping.py so both paths share one mapping
+from index_mapping import INDEX_NAME, IMAGE_EMBEDDING_DIMENSION, index_body, product_id, bump_catalogue_version
+# ...and from INGESTION/opensearch_client.py for the same pooled, compressed client
+from opensearch_client import get_client as get_opensearch
+
+# Clients are built on first use and reused by warm invocations. Each handler only pays for
+# what it touches: compaction never builds the Bedrock or OpenSearch clients.
+@lru_cache(maxsize=None)
+def get_s3():
+    return boto3.client('s3')
+
+@lru_cache(maxsize=None)
+def get_bedrock():
+    return boto3.client('bedrock-runtime')
 
 BUCKET_NAME = 'testbucketwwcuteboys'  # <-- Replace with your bucket
-CSV_KEY = 'products.csv'
+# One JSONL record per product until compaction merges it; when it was written is in created_at
+PARTS_PREFIX = 'products/parts/'
+# Columnar snapshot that compaction_handler rebuilds from the parts
+CONSOLIDATED_KEY = 'products/products.parquet'
+PRODUCT_FIELDS = ["name", "description", "price", "imageUrl", "created_at"]
+# Images described in parallel within one invocation
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', '4'))
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v2:0"
+IMAGE_EMBEDDING_MODEL_ID = "amazon.titan-embed-image-v1"
+
+_index_ready = False
+_image_field_ready = False
 
 def generate_product_description_claude(text_label):
     prompt = f"""
@@ -27,7 +57,7 @@ Product context: {text_label}
         "stop_sequences": []
     })
 
-    response = bedrock.invoke_model(
+    response = get_bedrock().invoke_model(
         modelId="anthropic.claude-v2",  # Change to claude-3 if available
         body=body,
         contentType="application/json",
@@ -56,37 +86,259 @@ def parse_description_to_row(desc_text):
 
     return [name, description, price]
 
-def lambda_handler(event, context):
-    # Get uploaded file info
-    image_key = event['Records'][0]['s3']['object']['key']
+def part_key_for(image_key):
+    """
+    S3 key of the product record for an image. Derived from the image key alone (no upload
+    date), so a re-delivered event overwrites its own record instead of adding a duplicate,
+    even on a later day.
+    """
+    return f"{PARTS_PREFIX}{product_id(image_key)}.jsonl"
 
+def write_product_record(image_key, row):
+    """Write the product record for one image; O(1) regardless of catalogue size"""
+    name, description, price = row
+    now = datetime.now(timezone.utc)
+    record = {
+        "name": name,
+        "description": description,
+        "price": price,
+        "imageUrl": image_key,
+        "created_at": now.isoformat(),
+    }
+    key = part_key_for(image_key)
+    get_s3().put_object(
+        Bucket=BUCKET_NAME,
+        Key=key,
+        Body=(json.dumps(record) + "\n").encode('utf-8'),
+        ContentType='application/x-ndjson'
+    )
+    return key
+
+def get_titan_embedding(text):
+    response = get_bedrock().invoke_model(
+        modelId=EMBEDDING_MODEL_ID,
+        body=json.dumps({"inputText": text}),
+        contentType='application/json'
+    )
+    embedding = json.loads(response['body'].read()).get('embedding')
+    if not embedding:
+        raise ValueError(f"No embedding returned for: {text[:80]}")
+    return embedding
+
+def get_titan_image_embedding(image_key):
+    """Multimodal embedding of the uploaded photo, for search-by-image; None if it can't be embedded"""
+    image = get_s3().get_object(Bucket=BUCKET_NAME, Key=image_key)['Body'].read()
+    try:
+        response = get_bedrock().invoke_model(
+            modelId=IMAGE_EMBEDDING_MODEL_ID,
+            body=json.dumps({
+                "inputImage": base64.b64encode(image).decode('utf-8'),
+                "embeddingConfig": {"outputEmbeddingLength": IMAGE_EMBEDDING_DIMENSION}
+            }),
+            contentType='application/json'
+        )
+    except ClientError as e:
+        # e.g. an oversized or unsupported image: still index the product for text search
+        if e.response.get('Error', {}).get('Code') != 'ValidationException':
+            raise
+        print(f"Cannot embed image {image_key}: {e}")
+        return None
+    return json.loads(response['body'].read()).get('embedding')
+
+def ensure_index():
+    """
+    Create the product index on first use if batch ingestion has not; never drops it.
+    An index created before vector_image existed gets the field added, so the first photo
+    embedding isn't dynamically mapped as a plain float array.
+    """
+    global _index_ready, _image_field_ready
+    if _index_ready:
+        return
+    from opensearchpy.exceptions import RequestError
+
+    opensearch = get_opensearch()
+    if not opensearch.indices.exists(index=INDEX_NAME):
+        try:
+            opensearch.indices.create(index=INDEX_NAME, body=index_body())
+            print(f"Created index '{INDEX_NAME}'")
+        except RequestError as e:
+            # Another concurrent invocation created it first
+            if e.error != 'resource_already_exists_exception':
+                raise
+    mapping = opensearch.indices.get_mapping(index=INDEX_NAME)
+    properties = next(iter(mapping.values()))['mappings'].get('properties', {})
+    image_field = properties.get('vector_image')
+    if image_field is None:
+        vector_image = index_body()['mappings']['properties']['vector_image']
+        opensearch.indices.put_mapping(index=INDEX_NAME, body={"properties": {"vector_image": vector_image}})
+        print(f"Added vector_image to index '{INDEX_NAME}'")
+        _image_field_ready = True
+    else:
+        _image_field_ready = image_field.get('type') == 'knn_vector'
+        if not _image_field_ready:
+            print(f"vector_image in '{INDEX_NAME}' is mapped as {image_field.get('type')}, not knn_vector; "
+                  "skipping image embeddings until the index is re-ingested")
+    _index_ready = True
+
+def index_product(image_key, row):
+    """
+    Embed the description and photo and upsert the product into the search index.
+    The document id is derived from the image key, so retries overwrite rather than duplicate.
+    """
+    name, description, price = row
+    ensure_index()
+    document = {
+        "name": name,
+        "description": description,
+        "price": price,
+        "imageUrl": image_key,
+        "vector_en": get_titan_embedding(description)
+    }
+    image_embedding = get_titan_image_embedding(image_key) if _image_field_ready else None
+    if image_embedding:
+        document["vector_image"] = image_embedding
+    get_opensearch().index(index=INDEX_NAME, id=product_id(image_key), body=document)
+
+def process_image(image_key):
+    """Describe one uploaded image with Claude, store its product record and make it searchable"""
     # Use filename as context (e.g. "Boho_Mustard_Dress.jpg" -> "Boho Mustard Dress")
-    product_context = image_key.replace('_', ' ').replace('-', ' ').replace('.jpg', '').replace('.png', '')
+    product_context = image_key.split('/')[-1].replace('_', ' ').replace('-', ' ').replace('.jpg', '').replace('.png', '')
 
     # Step 1: Generate description from Claude via Bedrock
     desc_text = generate_product_description_claude(product_context)
     
-    # Step 2: Convert response to CSV row
+    # Step 2: Convert response to a product row
     row = parse_description_to_row(desc_text)
 
-    # Step 3: Load existing CSV (or initialize new)
+    # Step 3: Append it as its own record (no read-modify-write of a shared file)
+    key = write_product_record(image_key, row)
+
+    # Step 4: Embed and upsert into the search index so it is searchable within seconds
+    index_product(image_key, row)
+    return key
+
+def iter_work_items(event):
+    """
+    Yield (message_id, image_key) for every image in the event.
+
+    Handles direct S3 notifications (message_id is None) and SQS batches whose bodies are
+    S3 notifications (one message may carry several images). A record that can't be
+    parsed yields image_key None, so only that message is failed, not the whole batch.
+    """
+    for record in event.get('Records', []):
+        message_id = record.get('messageId') if record.get('eventSource') == 'aws:sqs' else None
+        try:
+            if message_id is not None:
+                body = json.loads(record['body'])
+                # s3:TestEvent and other non-object messages carry no Records
+                keys = [unquote_plus(s3_record['s3']['object']['key']) for s3_record in body.get('Records', [])]
+            elif 's3' in record:
+                keys = [unquote_plus(record['s3']['object']['key'])]
+            else:
+                keys = []
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Malformed record {message_id}: {e!r}")
+            yield message_id, None
+            continue
+        for image_key in keys:
+            yield message_id, image_key
+
+def lambda_handler(event, context):
+    work = list(iter_work_items(event))
+    if not work:
+        return {'statusCode': 200, 'body': "No images in event", 'batchItemFailures': []}
+
+    items = [(message_id, image_key) for message_id, image_key in work if image_key is not None]
+    # Malformed records fail on their own, without taking the rest of the batch with them
+    failed = [(message_id, "<malformed record>") for message_id, image_key in work if image_key is None]
+    # Build the clients before fanning out: boto3.client() on the default session isn't
+    # thread-safe, so concurrent first uses in the workers could fail to construct them
+    get_s3(), get_bedrock(), get_opensearch()
+    # Claude calls dominate; a few in flight amortise the invocation without tripping Bedrock quotas
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENCY, len(items)))) as pool:
+        futures = {pool.submit(process_image, image_key): (message_id, image_key) for message_id, image_key in items}
+        for future in as_completed(futures):
+            message_id, image_key = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to process {image_key}: {e}")
+                failed.append((message_id, image_key))
+
+    # One refresh + version bump for the whole batch, not a cluster-wide refresh per image
+    if len(failed) < len(work):
+        try:
+            bump_catalogue_version(get_opensearch())
+        except Exception as e:
+            # The products are indexed; cached searches just miss them until the next bump
+            print(f"Failed to bump the catalogue version: {e}")
+
+    failed_messages = {message_id for message_id, _ in failed if message_id is not None}
+    # Direct S3 invocations have no partial-batch contract: fail so Lambda retries the event.
+    # Records are idempotent per image key, so re-processing the successful ones is harmless.
+    if failed and not failed_messages:
+        raise RuntimeError(f"Failed to process {len(failed)} of {len(work)} images: {[key for _, key in failed]}")
+
+    return {
+        'statusCode': 200,
+        'body': f"Processed {len(work) - len(failed)} of {len(work)} images",
+        # SQS ReportBatchItemFailures: only these messages are retried
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(failed_messages)]
+    }
+
+def list_part_keys():
+    paginator = get_s3().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=PARTS_PREFIX):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+def compaction_handler(event, context):
+    """
+    Scheduled job (e.g. EventBridge rate(1 hour)): merge the per-product parts into the
+    consolidated Parquet file, newest record per imageUrl winning, then delete the parts
+    that were merged. Parts written while this runs are left for the next run.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    s3 = get_s3()
+    part_keys = list(list_part_keys())
+    if not part_keys:
+        return {'statusCode': 200, 'body': "No parts to compact"}
+
+    products = {}
     try:
-        obj = s3.get_object(Bucket=BUCKET_NAME, Key=CSV_KEY)
-        content = obj['Body'].read().decode('utf-8')
-        rows = list(csv.reader(io.StringIO(content)))
+        obj = s3.get_object(Bucket=BUCKET_NAME, Key=CONSOLIDATED_KEY)
+        for record in pq.read_table(io.BytesIO(obj['Body'].read())).to_pylist():
+            products[record['imageUrl']] = record
     except s3.exceptions.NoSuchKey:
-        rows = [["Product Name", "Product Description", "Price"]]
+        pass
 
-    rows.append(row)
+    for key in part_keys:
+        body = s3.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read().decode('utf-8')
+        for line in body.splitlines():
+            if line.strip():
+                record = json.loads(line)
+                current = products.get(record['imageUrl'])
+                if current is None or record['created_at'] >= current['created_at']:
+                    products[record['imageUrl']] = record
 
-    # Step 4: Write updated CSV to S3
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerows(rows)
+    table = pa.Table.from_pylist(
+        [{field: record.get(field) for field in PRODUCT_FIELDS} for record in products.values()],
+        schema=pa.schema([(field, pa.string()) for field in PRODUCT_FIELDS])
+    )
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='zstd')
+    s3.put_object(Bucket=BUCKET_NAME, Key=CONSOLIDATED_KEY, Body=buffer.getvalue())
 
-    s3.put_object(Bucket=BUCKET_NAME, Key=CSV_KEY, Body=output.getvalue().encode('utf-8'))
+    # Only after the snapshot is durable
+    for start in range(0, len(part_keys), 1000):
+        s3.delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in part_keys[start:start + 1000]], 'Quiet': True}
+        )
 
     return {
         'statusCode': 200,
-        'body': f"Processed image: {image_key}"
+        'body': f"Compacted {len(part_keys)} parts into {len(products)} products"
     }